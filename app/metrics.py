@@ -0,0 +1,14 @@
+import os
+
+
+# METRICS
+# defined with prometheus_client in the modules they measure and served on /metrics (see visualization/monitoring.py);
+# under gunicorn, the web workers and the refresh worker write their samples into multiprocess_path
+# (gunicorn.conf.py sets it as prometheus_multiproc_dir before any of them imports prometheus_client)
+# and /metrics adds them up, a process started otherwise serves only its own metrics
+
+metrics_path = os.path.join('data', 'metrics')
+multiprocess_path = os.path.join(metrics_path, 'prometheus')
+
+seconds_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+bytes_buckets = [256, 1024, 4096, 16384, 65536, 262144, 1048576]
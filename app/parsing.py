@@ -1,99 +1,543 @@
+import numpy as np
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 import re
 import json
 import os
+import io
+import sys
+import time
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import threading
+import multiprocessing
+from contextlib import closing
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from prometheus_client import Counter, Histogram
 
+try:
+    from app.store import store_path, month_names, topics_days, topics_months, write_atomic # in heroku
+    from app.metrics import seconds_buckets
+except ImportError:
+    from store import store_path, month_names, topics_days, topics_months, write_atomic # locally
+    from metrics import seconds_buckets
 
-def get_dataframes_months(url, topics, years):
+
+# FETCHING
+max_workers = 4 # requests in flight at once
+requests_per_second = 10 # per host, the library server is small
+retries = 3
+backoff = 0.5 # in seconds, doubles with each retry
+timeout = 30 # in seconds
+
+# PARSING
+parse_processes = os.cpu_count()
+parse_processes_min_pages = 16 # month pages, fewer ones are parsed faster than the pool starts
+# pool processes are not forked from this one, whose fetch threads may hold locks at that moment
+parse_start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# DISCOVERY
+first_year = 2015 # the library web has no older statistics
+
+# METRICS (served by the web app, see metrics.py), pages are labelled by their topic
+fetch_seconds = Histogram('scraper_fetch_seconds', 'Duration of page requests, each attempt', ['page'], buckets=seconds_buckets)
+responses_total = Counter('scraper_responses_total', 'Page responses by status, error for failed connections', ['page', 'status'])
+retries_total = Counter('scraper_retries_total', 'Page requests tried again', ['page'])
+parse_seconds = Histogram('scraper_parse_seconds', 'Duration of parsing one page', ['page'], buckets=seconds_buckets)
+
+# RAW PAGES
+archive_path = os.path.join('data', 'archive.sqlite')
+
+archive_schema = '''
+CREATE TABLE IF NOT EXISTS pages (
+    link TEXT, fetched REAL, sha256 TEXT, content BLOB, -- content is zlib compressed html
+    PRIMARY KEY (link, fetched)
+) WITHOUT ROWID;
+'''
+
+# STORE (store_path and month_names are in store.py)
+store_schema = '''
+CREATE TABLE IF NOT EXISTS days (
+    topic TEXT, year INTEGER, month INTEGER, day INTEGER,
+    count INTEGER,
+    PRIMARY KEY (topic, year, month, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS months (
+    topic TEXT, year INTEGER, month INTEGER, position INTEGER,
+    label TEXT, heading TEXT, place TEXT, value INTEGER,
+    PRIMARY KEY (topic, year, month, position)
+) WITHOUT ROWID;
+
+-- counts of the single datasets of the library charts, which sum up to days.count
+CREATE TABLE IF NOT EXISTS day_datasets (
+    topic TEXT, year INTEGER, month INTEGER, position INTEGER, day INTEGER,
+    dataset TEXT, count INTEGER,
+    PRIMARY KEY (topic, year, month, position, day)
+) WITHOUT ROWID;
+
+-- data version in which a partition last changed, month is 0 for months data
+CREATE TABLE IF NOT EXISTS partitions (
+    topic TEXT, year INTEGER, month INTEGER,
+    version INTEGER,
+    PRIMARY KEY (topic, year, month)
+) WITHOUT ROWID;
+'''
+
+
+class RateLimiter:
+    # lets at most `rate` requests start every second
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_start = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        time.sleep(start - now)
+
+
+def make_session(workers):
+    # one keep-alive connection per worker
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class Manifest:
+    # remembers validators and hashes of downloaded pages and saved data,
+    # so unchanged pages are not parsed and unchanged data are not rewritten
+    def __init__(self, path=os.path.join('data', 'manifest.json')):
+        self.path = path
+        self.sources = {}
+        self.partitions = {}
+        self.pending = {} # sources of data not yet saved
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                content = json.load(f)
+            self.sources = content['sources']
+            self.partitions = content['partitions']
+
+    def request_headers(self, link):
+        source = self.sources.get(link, {})
+        headers = {}
+        if 'etag' in source:
+            headers['If-None-Match'] = source['etag']
+        if 'last_modified' in source:
+            headers['If-Modified-Since'] = source['last_modified']
+        return headers
+
+    def is_changed(self, link, page):
+        if page.status_code == 304:
+            return False
+
+        source = {'hash': hashlib.sha256(page.content).hexdigest()}
+        if 'ETag' in page.headers:
+            source['etag'] = page.headers['ETag']
+        if 'Last-Modified' in page.headers:
+            source['last_modified'] = page.headers['Last-Modified']
+        self.pending[link] = source
+
+        return self.sources.get(link, {}).get('hash') != source['hash']
+
+    def is_changed_data(self, key, df):
+        # key names the partition of the store, e.g. access/2019/5
+        digest = hashlib.sha256(df.to_csv().encode('utf-8')).hexdigest()
+        changed = self.partitions.get(key) != digest
+        self.partitions[key] = digest
+        return changed
+
+    def commit(self):
+        # call after the data of all fetched pages were saved, an interrupted run then continues from here
+        self.sources.update(self.pending)
+        self.pending.clear()
+
+        content = json.dumps({'sources': self.sources, 'partitions': self.partitions}, indent=1, sort_keys=True)
+        write_atomic(self.path, content.encode('utf-8'))
+
+
+def link_topic(link):
+    # .../statistics/<topic>/<year>/<month>
+    parts = urlsplit(link).path.strip('/').split('/')
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+def fetch_page(session, link, limiter, headers=None):
+    topic = link_topic(link)
+    for attempt in range(retries + 1):
+        limiter.wait()
+        start = time.perf_counter()
+        try:
+            page = session.get(link, headers=headers, timeout=timeout)
+            fetch_seconds.labels(topic).observe(time.perf_counter() - start)
+            responses_total.labels(topic, page.status_code).inc()
+            # retry only what can get better by waiting
+            if page.status_code != 429 and page.status_code < 500:
+                page.raise_for_status()
+                return page
+        except (requests.ConnectionError, requests.Timeout):
+            responses_total.labels(topic, 'error').inc()
+            if attempt == retries:
+                raise
+
+        if attempt < retries:
+            retries_total.labels(topic).inc()
+            time.sleep(backoff * 2 ** attempt)
+
+    page.raise_for_status()
+
+
+class PageArchive:
+    # every downloaded version of every page, so the parser can be run again on the whole history without the library web,
+    # a page is stored again only when its content changed
+    # with at (unix time), the archive looks as it was then
+    def __init__(self, path=archive_path, at=None):
+        self.path = path
+        self.at = at
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(sqlite3.connect(path, timeout=timeout)) as con:
+            con.executescript(archive_schema)
+
+    def latest(self, con, link):
+        return con.execute(
+            'SELECT sha256, content FROM pages WHERE link = ? AND fetched <= ? ORDER BY fetched DESC LIMIT 1',
+            (link, self.at or float('inf'))
+        ).fetchone()
+
+    def get(self, link):
+        # returns None for pages never downloaded
+        with closing(sqlite3.connect(self.path, timeout=timeout)) as con:
+            row = self.latest(con, link)
+        return zlib.decompress(row[1]) if row else None
+
+    def put(self, link, content, fetched=None):
+        sha256 = hashlib.sha256(content).hexdigest()
+        with closing(sqlite3.connect(self.path, timeout=timeout)) as con, con:
+            row = self.latest(con, link)
+            if row and row[0] == sha256:
+                return
+            con.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)', (link, fetched or time.time(), sha256, zlib.compress(content, 9)))
+
+    def history(self, link):
+        # fetch times of all stored versions of the page
+        with closing(sqlite3.connect(self.path, timeout=timeout)) as con:
+            return [fetched for fetched, in con.execute('SELECT fetched FROM pages WHERE link = ? ORDER BY fetched', (link,))]
+
+
+def fetch_pages(links, workers=max_workers, rate=requests_per_second, manifest=None, missing=False):
+    # download all links concurrently, contents are returned in the same order as links
+    # with manifest, pages unchanged since the last commit are returned as None
+    # with missing, nonexistent pages (404) are returned as None instead of raising
+    return list(iter_pages(links, workers, rate, manifest, missing))
+
+
+def iter_pages(links, workers=max_workers, rate=requests_per_second, manifest=None, missing=False):
+    # the same as fetch_pages, but yields each page as soon as it and all the previous ones are downloaded
+    hosts = {urlsplit(link).netloc for link in links}
+    limiters = {host: RateLimiter(rate) for host in hosts}
+
+    def fetch(link):
+        headers = manifest.request_headers(link) if manifest else None
+        try:
+            page = fetch_page(session, link, limiters[urlsplit(link).netloc], headers)
+        except requests.HTTPError as e:
+            if missing and e.response.status_code == 404:
+                return None
+            raise
+        if manifest and not manifest.is_changed(link, page):
+            return None
+        return page.content
+
+    with make_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(fetch, links)
+
+
+def get_pages(links, workers=max_workers, manifest=None, archive=None, replay=False, missing=False):
+    # first stage: yields raw pages in the order of links, from the web or only from the archive when replaying
+    if replay:
+        for link in links:
+            yield archive.get(link)
+        return
+
+    for link, content in zip(links, iter_pages(links, workers, manifest=manifest, missing=missing)):
+        if archive and content is not None:
+            archive.put(link, content)
+        yield content
+
+
+def parse_timed(parse, content):
+    # runs in the pool processes too, so the duration comes back with the dataframe
+    start = time.perf_counter()
+    df = parse(content)
+    return df, time.perf_counter() - start
+
+
+parse_pool = None
+
+def get_parse_pool():
+    # started on first use and reused by all later calls, its processes import the modules only once
+    global parse_pool
+    if parse_pool is None:
+        parse_pool = ProcessPoolExecutor(max_workers=parse_processes, mp_context=multiprocessing.get_context(parse_start_method))
+    return parse_pool
+
+
+def get_dataframes(links, parse, workers=max_workers, manifest=None, archive=None, replay=False, processes=False):
+    # second stage: parses pages while the next ones are still being downloaded, with processes across the parse pool,
+    # which pays off only for many month pages (BeautifulSoup), day pages are parsed faster than they are sent to it;
+    # missing and unchanged pages (see Manifest) are not parsed and their dataframes are None
+    pages = get_pages(links, workers, manifest, archive, replay)
+
+    if not processes or len(links) < parse_processes_min_pages:
+        results = [parse_timed(parse, content) if content is not None else None for content in pages]
+    else:
+        futures = [get_parse_pool().submit(parse_timed, parse, content) if content is not None else None for content in pages]
+        results = [future.result() if future else None for future in futures]
+
+    dataframes = []
+    for link, result in zip(links, results):
+        if result is None:
+            dataframes.append(None)
+            continue
+        df, seconds = result
+        parse_seconds.labels(link_topic(link)).observe(seconds)
+        dataframes.append(df)
+    return dataframes
+
+
+def parse_page_months(content):
+    soup = BeautifulSoup(content, 'html.parser')
+
+    table = soup.find("table")
+    df = pd.read_html(io.StringIO(str(table)), index_col=0)[0]
+    #df.columns.set_levels([df.columns[3*i][0] + ' ' + link[-4:] for i in range(len(df.columns.levels[0]))], level=0, inplace=True)
+    return df
+
+
+def parse_page_topics(content):
+    # topics are the tabs linked from every page
+    topics = re.findall(rb'href="[^"]*/statistics/([a-z]+)"', content)
+    return list(dict.fromkeys(topic.decode() for topic in topics))
+
+
+def parse_published_months(df):
+    # months listed in a summary table, without the total
+    return [month_names.index(name) + 1 for name in df.index if name != month_names[-1]]
+
+
+def discover(url, years=None, workers=max_workers, archive=None, replay=False):
+    # which topics, years and months the library web publishes, read from the summary pages of the years until now
+    # returns topics, {year: [months]} and {year: summary dataframe}, years without any published month are left out
+    years = years or range(first_year, datetime.date.today().year + 1)
+    links = [f'{url}/summary/{year}' for year in years]
+
+    topics, published, summaries = [], {}, {}
+    for year, content in zip(years, get_pages(links, workers, archive=archive, replay=replay, missing=True)):
+        if content is None or b'<table' not in content:
+            continue
+
+        topics = topics or parse_page_topics(content)
+        df = parse_page_months(content)
+        months = parse_published_months(df)
+        if months:
+            published[year] = months
+            summaries[year] = df
+
+    return topics, published, summaries
+
+
+def get_dataframes_months(url, topics, years, workers=max_workers, manifest=None, archive=None, replay=False):
     # get links to subsites with months data for given topics and years
     links = [f'{url}/{topic}/{year}' for topic in topics for year in years]
 
-    # loop through all links and parse data from them into dataframes
-    dataframes_months = []
-    for link in links:
-        page = requests.get(link)
-        soup = BeautifulSoup(page.content, 'html.parser')
+    # download all pages and parse data from them into dataframes
+    return get_dataframes(links, parse_page_months, workers, manifest, archive, replay, processes=True)
 
-        table = soup.find("table")
-        df = pd.read_html(str(table), index_col=0)[0]
-        #df.columns.set_levels([df.columns[3*i][0] + ' ' + link[-4:] for i in range(len(df.columns.levels[0]))], level=0, inplace=True)
-        dataframes_months.append(df)
-    
-    return dataframes_months
 
+def get_dataframes_months_year(url, topics, year, summaries, workers=max_workers, manifest=None, archive=None, replay=False):
+    # the same as get_dataframes_months for one year, but summary pages already parsed by discover are not downloaded again
+    fetched = [topic for topic in topics if topic != 'summary']
+    dataframes = dict(zip(fetched, get_dataframes_months(url, fetched, [year], workers, manifest, archive, replay)))
+    dataframes['summary'] = summaries.get(year)
+    return [dataframes[topic] for topic in topics]
 
-def get_dataframes_days(url, topics, years, months):
+
+chart_data_pattern = re.compile(rb'var totalChartData = (.*?);')
+
+
+def parse_chart_data(content):
+    # reads the chart data straight from the page bytes, without building the whole html tree
+    # and without relying on the position of the script in the page
+    match = chart_data_pattern.search(content)
+    if match is None:
+        raise ValueError('page contains no totalChartData')
+
+    text = match.group(1).decode('utf-8')
+    # replaces are for removing invalid json parts, \uXXXX escapes in labels are valid and kept
+    return json.loads(re.sub(r'\\(?!u[0-9a-fA-F]{4})', '', text.replace('\'', '"')))
+
+
+def make_dataframe_days(data):
+    # one column with the sum of all datasets of the chart and one column for each of them
+    counts = np.array([dataset['data'] for dataset in data['datasets']], dtype=np.int64)
+
+    df = pd.DataFrame(counts.T, columns=[dataset['label'] for dataset in data['datasets']])
+    df.insert(0, 'Počet', counts.sum(axis=0))
+    df.index = pd.RangeIndex(1, counts.shape[1] + 1, name='Den')
+    return df
+
+
+def parse_page_days(content):
+    return make_dataframe_days(parse_chart_data(content))
+
+
+def get_dataframes_days(url, topics, years, months, workers=max_workers, manifest=None, archive=None, replay=False):
     # get links to subsites with days data for given topics and years
-    # includes links to nonexisting data -> resulting dataframes are filled with zeroes
+    # only published months should be asked for (see discover), others are filled with zeroes
     links = [f'{url}/{topic}/{year}/{month}' for topic in topics for year in years for month in months]
 
-    # loop through all links and parse data from them into dataframes
-    dataframes_days = []
-    for link in links:
-        page = requests.get(link)
-        soup = BeautifulSoup(page.content, 'html.parser')
-
-        text = str(soup.find_all('script')[3])
-        pattern = re.compile('var totalChartData = (.*?);')
-        match = pattern.search(text)
-        data = json.loads(match.groups()[0].replace('\'', '"').replace('\\', '')) # replaces are for removing invalid json parts
-
-        # all data parts are summed together
-        res = []
-        for i in range(len(data['datasets'][0]['data'])):
-            val = 0
-            for j in range(len(data['datasets'])):
-                val += data['datasets'][j]['data'][i]
-            res.append(val)
-
-        data = enumerate(res, start=1)
-
-        df = pd.DataFrame(data, columns=['Den', 'Počet']) 
-        df.set_index('Den', inplace=True)
-
-        dataframes_days.append(df)
-
-    return dataframes_days
-
-
-def save_months_to_csv(dataframes, subfolder, topics, years):
-    # create file structure if not exists
-    path = os.path.join('data', subfolder)
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-    i = 0
-    for topic in topics:
-        for year in years:
-            path = os.path.join('data', subfolder, f'{topic}_{year}.csv')
-            dataframes[i].to_csv(path)
-            i += 1
-
-
-def save_days_to_csv(dataframes, subfolder, topics, years, months):
-    # create file structure if not exists
-    paths = [os.path.join('data', subfolder, str(year)) for year in years]
-    for path in paths:
-        if not os.path.exists(path):
-            os.makedirs(path)
-
-    i = 0
-    for topic in topics:
-        for year in years:
-            for month in months:
-                path = os.path.join('data', subfolder, str(year), f'{topic}_{year}_{month}.csv')
-                dataframes[i].to_csv(path)
+    # download all pages and parse data from them into dataframes
+    return get_dataframes(links, parse_page_days, workers, manifest, archive, replay)
+
+
+def connect_store(path=store_path):
+    # create the store if not exists
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    con = sqlite3.connect(path, timeout=timeout)
+    con.executescript(store_schema)
+    return con
+
+
+def publish_version(con, written):
+    # changed partitions get a new data version in the same transaction as their data,
+    # so readers see either the old data and version or the new ones
+    if not written:
+        return
+
+    version = con.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM partitions').fetchone()[0]
+    con.executemany('INSERT OR REPLACE INTO partitions VALUES (?, ?, ?, ?)', [
+        (topic, year, month or 0, version) for topic, year, month in written
+    ])
+
+
+def save_months_to_store(dataframes, topics, years, manifest=None, path=store_path):
+    # returns (topic, year, None) of the partitions which changed
+    written = []
+    with closing(connect_store(path)) as con, con:
+        i = 0
+        for topic in topics:
+            for year in years:
+                df = dataframes[i]
                 i += 1
+                if df is None or manifest and not manifest.is_changed_data(f'{topic}/{year}', df):
+                    continue
+
+                con.execute('DELETE FROM months WHERE topic = ? AND year = ?', (topic, year))
+                con.executemany('INSERT INTO months VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                    (topic, year, month_names.index(label) + 1, position, label, heading, place, int(value))
+                    for label, row in zip(df.index, df.values)
+                    for position, ((heading, place), value) in enumerate(zip(df.columns, row))
+                ])
+                written.append((topic, year, None))
+
+        publish_version(con, written)
+
+    return written
+
+
+def save_days_to_store(dataframes, topics, years, months, manifest=None, path=store_path):
+    # returns (topic, year, month) of the partitions which changed
+    written = []
+    with closing(connect_store(path)) as con, con:
+        i = 0
+        for topic in topics:
+            for year in years:
+                for month in months:
+                    df = dataframes[i]
+                    i += 1
+                    if df is None or manifest and not manifest.is_changed_data(f'{topic}/{year}/{month}', df):
+                        continue
+
+                    con.execute('DELETE FROM days WHERE topic = ? AND year = ? AND month = ?', (topic, year, month))
+                    con.executemany('INSERT INTO days VALUES (?, ?, ?, ?, ?)', [
+                        (topic, year, month, int(day), int(count))
+                        for day, count in zip(df.index, df['Počet'])
+                    ])
+                    con.execute('DELETE FROM day_datasets WHERE topic = ? AND year = ? AND month = ?', (topic, year, month))
+                    con.executemany('INSERT INTO day_datasets VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                        (topic, year, month, position, int(day), dataset, int(count))
+                        for position, dataset in enumerate(df.columns[1:])
+                        for day, count in zip(df.index, df.iloc[:, position + 1])
+                    ])
+                    written.append((topic, year, month))
+
+        publish_version(con, written)
+
+    return written
+
+
+def migrate_csv_to_store(folder='data', path=store_path):
+    # one-shot import of the former csv files data/months/<topic>_<year>.csv and data/days/<year>/<topic>_<year>_<month>.csv
+    for name in sorted(os.listdir(os.path.join(folder, 'months'))):
+        topic, year = name[:-len('.csv')].split('_')
+        df = pd.read_csv(os.path.join(folder, 'months', name), header=[0,1], index_col=0)
+        save_months_to_store([df], [topic], [int(year)], path=path)
+
+    for year in sorted(os.listdir(os.path.join(folder, 'days'))):
+        for name in sorted(os.listdir(os.path.join(folder, 'days', year))):
+            topic, year, month = name[:-len('.csv')].split('_')
+            df = pd.read_csv(os.path.join(folder, 'days', year, name), index_col=0)
+            save_days_to_store([df], [topic], [int(year)], [int(month)], path=path)
+
+
+def delete_unpublished_days(published, path=store_path):
+    # removes the zero-filled days of months which the library web does not publish,
+    # only in the given years; returns (topic, year, month) of the removed partitions
+    with closing(connect_store(path)) as con, con:
+        stored = con.execute('SELECT DISTINCT topic, year, month FROM days').fetchall()
+        deleted = [(topic, year, month) for topic, year, month in stored if year in published and month not in published[year]]
+
+        for table in ['days', 'day_datasets']:
+            con.executemany(f'DELETE FROM {table} WHERE topic = ? AND year = ? AND month = ?', deleted)
+        publish_version(con, deleted)
+
+    return deleted
 
 
 def update_data(url, topics_days, topics_months, year, month):
-    dataframes_days = get_dataframes_days(url, topics_days, [year], [month])
-    save_days_to_csv(dataframes_days, 'days/', topics_days, [year], [month])
+    # returns (topic, year, month) of the partitions which changed, month is None for months data
+    manifest = Manifest()
+    archive = PageArchive()
+
+    # a new month is fetched only when the library web lists it
+    topics, published, summaries = discover(url, [year], archive=archive)
+    topics_days = [topic for topic in topics_days if topic in topics]
+    topics_months = [topic for topic in topics_months if topic in topics]
+    months = [month] if month in published.get(year, []) else []
 
-    dataframes_months = get_dataframes_months(url, topics_months, [year])
-    save_months_to_csv(dataframes_months, 'months', topics_months, [year])
+    dataframes_days = get_dataframes_days(url, topics_days, [year], months, manifest=manifest, archive=archive)
+    written = save_days_to_store(dataframes_days, topics_days, [year], months, manifest)
+
+    dataframes_months = get_dataframes_months_year(url, topics_months, year, summaries, manifest=manifest, archive=archive)
+    written += save_months_to_store(dataframes_months, topics_months, [year], manifest)
+
+    manifest.commit()
+    return written
 
 
 ####################################################################################################
@@ -103,17 +547,38 @@ if __name__ == "__main__":
     '''
     all availible topics are: access, login, rating, search, summary
         summary contains data from access, login and search
-    all availible years are: 2015 - 2020
+    availible years and months are discovered from the summary pages
     '''
 
-    url = 'https://susice.tritius.cz/statistics'
-    years = [i for i in range(2015, 2021)]
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--migrate', action='store_true', help='import the former csv files from data/ into the store')
+    parser.add_argument('--url', default='https://susice.tritius.cz/statistics', help='e.g. a local stand-in server (tests/standin.py)')
+    parser.add_argument('--replay', action='store_true', help=f'parse pages from {archive_path} instead of downloading them')
+    parser.add_argument('--replay-at', type=float, help='replay the archive as it was at this unix time')
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate_csv_to_store()
+        sys.exit()
+
+    url = args.url
+
+    # year by year, so an interrupted run continues with the first unsaved year
+    # (pages committed to the manifest are skipped, remove data/manifest.json to parse everything again)
+    manifest = Manifest()
+    archive = PageArchive(at=args.replay_at)
+    replay = args.replay or args.replay_at is not None
+
+    topics, published, summaries = discover(url, archive=archive, replay=replay)
+    topics_months = [topic for topic in topics_months if topic in topics]
+    topics_days = [topic for topic in topics_days if topic in topics]
+    delete_unpublished_days(published)
+
+    for year, months in published.items():
+        dataframes_months = get_dataframes_months_year(url, topics_months, year, summaries, manifest=manifest, archive=archive, replay=replay)
+        save_months_to_store(dataframes_months, topics_months, [year], manifest)
 
-    topics_months = ['rating', 'summary']
-    dataframes_months = get_dataframes_months(url, topics_months, years)
-    save_months_to_csv(dataframes_months, 'months', topics_months, years)
+        dataframes_days = get_dataframes_days(url, topics_days, [year], months, manifest=manifest, archive=archive, replay=replay)
+        save_days_to_store(dataframes_days, topics_days, [year], months, manifest)
 
-    months = range(1,13)
-    topics_days = ['access', 'login', 'search']
-    dataframes_days = get_dataframes_days(url, topics_days, years, months)
-    save_days_to_csv(dataframes_days, 'days/', topics_days, years, months)
+        manifest.commit()
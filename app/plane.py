@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from contextlib import closing
+
+import numpy as np
+
+try:
+    from app.store import store_path, write_atomic # in heroku
+except ImportError:
+    from store import store_path, write_atomic # locally
+
+
+# DATA PLANE
+# daily arrays written as .npy files by the gunicorn master before it starts the web workers (see gunicorn.conf.py)
+# and by the refresh worker (app/refresh.py) after each change of the store;
+# web workers map them read-only, so all of them share one copy in the page cache and none builds the arrays
+# data/plane/current.json points to the newest plane, older planes are removed after keep_planes newer ones
+
+plane_path = os.path.join('data', 'plane')
+keep_planes = 2
+
+day_dtype = np.uint16 # a single day is far under 65535
+
+array_names = ['years', 'cube', 'dates', 'series']
+
+
+def store_version(path=store_path):
+    # the newest data version published in the store
+    with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as con:
+        return con.execute('SELECT COALESCE(MAX(version), 0) FROM partitions').fetchone()[0]
+
+
+def build_arrays(topics, path=store_path):
+    # years, (topic, year, month, day) cube with zeroes for missing days,
+    # sorted dates of the stored days and (topic, date) series
+    with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as con:
+        rows = con.execute(
+            f'SELECT topic, year, month, day, count FROM days WHERE topic IN ({", ".join("?" * len(topics))})', topics
+        ).fetchall()
+
+    topic, year, month, day, count = np.array(
+        [(topics.index(row[0]), *row[1:]) for row in rows], dtype=np.int64
+    ).reshape(-1, 5).T
+
+    years = np.unique(year)
+    cube = np.zeros((len(topics), len(years), 12, 31), dtype=day_dtype)
+    cube[topic, np.searchsorted(years, year), month - 1, day - 1] = count
+
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    dates, positions = np.unique(months.astype('datetime64[D]') + (day - 1), return_inverse=True)
+    series = np.zeros((len(topics), len(dates)), dtype=day_dtype)
+    series[topic, positions] = count
+
+    return {'years': years, 'cube': cube, 'dates': dates, 'series': series}
+
+
+def write_plane(topics, path=store_path, folder=plane_path):
+    # a new plane is written next to the current one and then pointed to, readers never see a half written one
+    version = store_version(path)
+    name = f'{version}-{time.time_ns()}'
+    os.makedirs(os.path.join(folder, name))
+
+    for array_name, array in build_arrays(topics, path).items():
+        np.save(os.path.join(folder, name, f'{array_name}.npy'), array)
+
+    pointer = {'name': name, 'store': os.path.abspath(path), 'version': version, 'topics': topics}
+    write_atomic(os.path.join(folder, 'current.json'), json.dumps(pointer).encode('utf-8'))
+
+    # workers still mapping a removed plane keep its files until they unmap them
+    planes = sorted((entry for entry in os.listdir(folder) if os.path.isdir(os.path.join(folder, entry))), key=lambda entry: int(entry.split('-')[1]))
+    for old in planes[:-keep_planes]:
+        shutil.rmtree(os.path.join(folder, old), ignore_errors=True)
+
+    return name
+
+
+def ensure_plane(topics, path=store_path, folder=plane_path):
+    # writes a plane only when the current one does not hold the newest data of the topics
+    if Plane(folder).get(topics, store_version(path), path) is None:
+        return write_plane(topics, path, folder)
+
+
+class Plane:
+    # read-only view of the current plane, mapped again only when the pointer changes
+    def __init__(self, folder=plane_path):
+        self.folder = folder
+        self.name = None
+        self.arrays = None
+        self.lock = threading.Lock()
+
+    def current(self, topics, version, path=store_path):
+        # pointer of the current plane if it holds the given data version of the topics from the store, else None
+        try:
+            with open(os.path.join(self.folder, 'current.json')) as f:
+                pointer = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if pointer['store'] != os.path.abspath(path) or pointer['version'] != version or pointer['topics'] != topics:
+            return None
+        return pointer
+
+    def get(self, topics, version, path=store_path):
+        # arrays of the current plane if it holds the given data version of the topics from the store, else None
+        pointer = self.current(topics, version, path)
+        if pointer is None:
+            return None
+
+        with self.lock:
+            if pointer['name'] != self.name:
+                try:
+                    self.arrays = {
+                        array_name: np.load(os.path.join(self.folder, pointer['name'], f'{array_name}.npy'), mmap_mode='r')
+                        for array_name in array_names
+                    }
+                except OSError: # removed meanwhile by a newer plane
+                    return None
+                self.name = pointer['name']
+            return self.arrays
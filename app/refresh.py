@@ -0,0 +1,75 @@
+import time
+import logging
+import datetime
+import argparse
+
+from prometheus_client import Counter, Gauge, Histogram
+
+try:
+    from app.parsing import update_data # in heroku
+    from app.plane import write_plane, ensure_plane
+    from app.store import topics_days, topics_months
+except ImportError:
+    from parsing import update_data # locally
+    from plane import write_plane, ensure_plane
+    from store import topics_days, topics_months
+
+
+# REFRESH WORKER
+# the only process which scrapes the library web, web workers pick up new data versions from the store
+# and map the daily arrays from the data plane written here (see plane.py)
+
+data_url = 'https://susice.tritius.cz/statistics'
+
+interval = 60 * 60 # in seconds
+
+# METRICS (served by the web app, see metrics.py)
+refresh_seconds = Histogram('refresh_seconds', 'Duration of refresh runs', buckets=[1, 2.5, 5, 10, 30, 60, 120, 300, 600])
+runs_total = Counter('refresh_runs_total', 'Refresh runs by result', ['result'])
+partitions_written_total = Counter('refresh_partitions_written_total', 'Partitions of the store changed by refreshes')
+last_success_time = Gauge('refresh_last_success_time', 'Unix time of the last successful refresh', multiprocess_mode='max')
+
+
+def refresh(url=data_url):
+    date = datetime.datetime.now()
+    written = update_data(url, topics_days, topics_months, date.year, date.month)
+    if written:
+        write_plane(topics_days)
+
+    logging.info('refreshed %d/%d, changed: %s', date.year, date.month, written or 'nothing')
+    return written
+
+
+def run(interval=interval, url=data_url):
+    while True:
+        start = time.monotonic()
+        try:
+            # web workers started before the first change map the current data too (gunicorn writes it before starting them)
+            ensure_plane(topics_days)
+            written = refresh(url)
+        except Exception:
+            # a failed scrape must not stop the next ones
+            logging.exception('refresh failed')
+            runs_total.labels('failed').inc()
+        else:
+            runs_total.labels('ok').inc()
+            partitions_written_total.inc(len(written))
+            last_success_time.set(time.time())
+
+        refresh_seconds.observe(time.monotonic() - start)
+
+        time.sleep(max(0, interval - (time.monotonic() - start)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--interval', type=int, default=interval, help='seconds between scrapes')
+    parser.add_argument('--once', action='store_true', help='scrape only once and exit')
+    parser.add_argument('--url', default=data_url)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.once:
+        refresh(args.url)
+    else:
+        run(args.interval, args.url)
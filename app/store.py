@@ -0,0 +1,33 @@
+import os
+
+
+# STORE
+# shared by the scraper (parsing.py), the refresh worker and the web app,
+# kept free of the scraper dependencies (requests, bs4), so web workers do not import them
+
+store_path = os.path.join('data', 'library.sqlite')
+# months tables rows, numbered from 1
+month_names = [
+    'Leden', 'Únor', 'Březen', 'Duben', 'Květen', 'Červen', 'Červenec',
+    'Srpen', 'Září', 'Říjen', 'Listopad', 'Prosinec', 'Souhrnně celkem'
+]
+# topics of the days and the months tables, the daily arrays are in topics_days order
+topics_days = ['access', 'login', 'search']
+topics_months = ['rating', 'summary']
+
+
+def write_atomic(path, content):
+    # readers never see a half written file
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def remove_database(path):
+    # an SQLite file with its write-ahead log, connections must not be open
+    for suffix in ['', '-wal', '-shm']:
+        try:
+            os.remove(f'{path}{suffix}')
+        except FileNotFoundError:
+            pass
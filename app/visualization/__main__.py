@@ -1,3 +1,12 @@
-import data, layout, app, interactivity
+import os
+import sys
 
-app.app.run_server(debug=True)
+# imported as a package from the project root, the same way as gunicorn does (see Procfile)
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.visualization.cache import shared_cache
+shared_cache.clear() # gunicorn clears it in gunicorn.conf.py
+
+from app.visualization.app import app
+
+app.run_server(debug=True)
@@ -0,0 +1,173 @@
+try:
+    from app.visualization.data import series, versions, topics_days, to_list # in heroku
+    from app.visualization.rollups import rollups
+    from app.visualization.app import app
+except ImportError:
+    from data import series, versions, topics_days, to_list # locally
+    from rollups import rollups
+    from app import app
+
+import json
+import hashlib
+
+import numpy as np
+from flask import Response, jsonify, request
+
+
+# GLOBAL VARS
+api_path = '/api/v1'
+
+granularities = ['day', 'month', 'year']
+places = {'library': 0, 'remote': 1, 'all': 2} # positions in rollups.places
+
+chunk_rows = 500 # rows per streamed chunk
+max_batch = 50 # queries in one request
+max_age = 5 * 60 # in seconds, ETag tells clients whether the data changed since
+
+
+# QUERIES
+# counts of topics over a date range by day, month or year, in the library, remote or all together
+# days come from the daily series, months and years from the rollups (only they are split by place),
+# months and years overlapping the range are returned whole, months not published yet are null
+
+def parse_date(text, end=False):
+    # 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD', as the first or with end the last day of the period
+    date = np.datetime64(text)
+    if date.dtype not in [np.dtype('datetime64[Y]'), np.dtype('datetime64[M]'), np.dtype('datetime64[D]')]:
+        raise ValueError
+    return (date + 1).astype('datetime64[D]') - 1 if end else date.astype('datetime64[D]')
+
+
+def parse_query(params):
+    # normalized query from request arguments or an item of a batch, ValueError messages are shown to the client
+    topics = params.get('topic') or topics_days
+    topics = topics.split(',') if isinstance(topics, str) else topics
+    if not isinstance(topics, list) or any(topic not in topics_days for topic in topics):
+        raise ValueError(f'topic must be some of {", ".join(topics_days)}')
+
+    # a batch item may hold any json, only text is looked up
+    granularity = params.get('granularity', 'day')
+    if not isinstance(granularity, str) or granularity not in granularities:
+        raise ValueError(f'granularity must be one of {", ".join(granularities)}')
+
+    place = params.get('place', 'all')
+    if not isinstance(place, str) or place not in places:
+        raise ValueError(f'place must be one of {", ".join(places)}')
+    if granularity == 'day' and place != 'all':
+        raise ValueError('days are not split by place, use place=all or a month or year granularity')
+
+    # the whole data by default
+    if granularity == 'day':
+        dates, counts = series.get()
+        first, last = (str(dates[0]), str(dates[-1])) if len(dates) else ('1970', '1970')
+    else:
+        years = rollups.get()['years']
+        first, last = (str(years[0]), str(years[-1])) if years else ('1970', '1970')
+
+    try:
+        if not all(isinstance(params.get(bound), (str, type(None))) for bound in ['start', 'end']):
+            raise TypeError
+        start = parse_date(params.get('start') or first)
+        end = parse_date(params.get('end') or last, end=True)
+    except (ValueError, TypeError):
+        raise ValueError('start and end must be dates as YYYY, YYYY-MM or YYYY-MM-DD')
+    if end < start:
+        raise ValueError('end must not be before start')
+
+    return {'topic': topics, 'start': str(start), 'end': str(end), 'granularity': granularity, 'place': place}
+
+
+def query_rows(query):
+    # yields [period, count of each topic]
+    topics = [topics_days.index(topic) for topic in query['topic']]
+
+    if query['granularity'] == 'day':
+        dates, counts = series.range(query['start'], query['end'])
+        yield from ([date, *values] for date, values in zip(dates.astype(str).tolist(), counts[topics].T.tolist()))
+        return
+
+    # periods as text compare as dates
+    tables = rollups.get()
+    place = places[query['place']]
+    for i, year in enumerate(tables['years']):
+        if not query['start'][:4] <= f'{year}' <= query['end'][:4]:
+            continue
+
+        if query['granularity'] == 'year':
+            yield [f'{year}'] + to_list(tables['totals'][topics, place, i], int)
+            continue
+
+        for month in range(1, 13):
+            if query['start'][:7] <= f'{year}-{month:02d}' <= query['end'][:7]:
+                yield [f'{year}-{month:02d}'] + to_list(tables['monthly'][topics, place, i, month - 1], int)
+
+
+def query_version(query):
+    # the newest version of the partitions the query reads, it changes only with the answer
+    years = {year for topic, year, month in versions.partitions if query['start'][:4] <= f'{year}' <= query['end'][:4]}
+    if not years:
+        return 0
+    if query['granularity'] == 'day':
+        return max(versions.get_days(year, month) for year in years for month in range(1, 13))
+    return max(versions.get('summary', year) for year in years)
+
+
+def encode_result(query):
+    # json text of the query answer in chunks, long ranges are sent while they are being encoded
+    yield json.dumps({'query': query, 'columns': ['period'] + query['topic']})[:-1] + ', "rows": ['
+
+    rows = []
+    first = True
+    for row in query_rows(query):
+        rows.append(json.dumps(row))
+        if len(rows) == chunk_rows:
+            yield ('' if first else ', ') + ', '.join(rows)
+            rows, first = [], False
+    yield ('' if first or not rows else ', ') + ', '.join(rows) + ']}'
+
+
+def encode_batch(items):
+    # answers in the order of the queries, an invalid query gets its error instead
+    yield '{"results": ['
+    for i, item in enumerate(items):
+        if i:
+            yield ', '
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('a query must be an object')
+            query = parse_query(item)
+        except ValueError as e:
+            yield json.dumps({'query': item, 'error': str(e)})
+            continue
+        yield from encode_result(query)
+    yield ']}'
+
+
+# API ROUTES
+# e.g. /api/v1/counts?topic=access,search&start=2019-03&end=2019-06-15&granularity=month&place=remote
+@app.server.route(f'{api_path}/counts')
+def api_counts():
+    try:
+        query = parse_query(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    response = Response(encode_result(query), mimetype='application/json')
+
+    # the query and the versions of the data it reads identify the answer
+    key = hashlib.sha1(json.dumps(query, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    response.set_etag(f'{key}-{query_version(query)}')
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+
+# several queries in one request, POST {"queries": [{"topic": "access", "granularity": "year"}, ...]}
+@app.server.route(f'{api_path}/batch', methods=['POST'])
+def api_batch():
+    body = request.get_json(silent=True)
+    items = body.get('queries') if isinstance(body, dict) else None
+    if not isinstance(items, list) or not 0 < len(items) <= max_batch:
+        return jsonify(error=f'the body must be {{"queries": [...]}} with 1 to {max_batch} queries'), 400
+
+    return Response(encode_batch(items), mimetype='application/json')
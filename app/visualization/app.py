@@ -1,10 +1,17 @@
-from data import update_library_data
-
-from concurrent.futures import ThreadPoolExecutor
+try:
+    from app.visualization import startup # in heroku
+    from app.visualization.data import reload_changed_data
+    from app.visualization.layout import make_layout
+except ImportError:
+    import startup # locally
+    from data import reload_changed_data
+    from layout import make_layout
 
 import dash
 import dash_bootstrap_components as dbc
 
+startup.mark('imports')
+
 
 # DASH APP INIT
 css = [dbc.themes.SUPERHERO]
@@ -24,6 +31,17 @@ app.layout = make_layout
 
 server = app.server # for gunicorn
 
-# RUN DATA UPDATE FUNC IN ANOTHER THREAD 
-executor = ThreadPoolExecutor(max_workers=1)
-executor.submit(update_library_data)
\ No newline at end of file
+# PICK UP DATA PUBLISHED BY THE REFRESH WORKER (app/refresh.py)
+server.before_request(reload_changed_data)
+
+startup.mark('app')
+
+# CALLBACKS, EXPORT, API AND METRICS ROUTES
+# registered here, gunicorn imports only this module
+try:
+    from app.visualization import interactivity, export, api, monitoring # in heroku
+except ImportError:
+    import interactivity, export, api, monitoring # locally
+
+startup.mark('callbacks')
+startup.log()
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import sqlite3
+import functools
+import threading
+
+from dash._utils import split_callback_id
+from prometheus_client import Counter
+
+try:
+    from app.store import remove_database # in heroku
+except ImportError:
+    from store import remove_database # locally
+
+
+# GLOBAL VARS
+cache_path = os.path.join('data', 'cache.sqlite')
+cache_size = 500 # entries
+touch_interval = 60 # in seconds, a hit writes the time of its use only when the stored one is older
+
+cache_requests_total = Counter('cache_requests_total', 'Memoized calls by function and result (hit or miss)', ['function', 'result'])
+
+
+# SHARED CACHE
+class SharedCache:
+    # texts in a small SQLite file shared by all workers on the machine,
+    # only the most recently used ones are kept, hits are mostly reads only, so workers do not wait for each other
+    def __init__(self, path=cache_path, size=cache_size, touch=touch_interval):
+        self.path = path
+        self.size = size
+        self.touch = touch
+        self.local = threading.local() # sqlite connections can not be shared between threads
+
+    def connect(self):
+        if not hasattr(self.local, 'con'):
+            con = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            con.execute('PRAGMA journal_mode=WAL') # readers do not wait for writers
+            con.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, used REAL)')
+            self.local.con = con
+        return self.local.con
+
+    def get(self, key):
+        # returns None for missing values, the cache is only a shortcut so its errors are misses too
+        try:
+            con = self.connect()
+            row = con.execute('SELECT value, used FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] >= self.touch:
+                con.execute('UPDATE cache SET used = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.Error:
+            return None
+
+        return row[0]
+
+    def clear(self):
+        # keys name only the callback and data versions, so responses of older code or of a rebuilt store
+        # are removed when the server starts, before any worker connects
+        remove_database(self.path)
+
+    def set(self, key, value):
+        try:
+            con = self.connect()
+            con.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (key, value, time.time()))
+            con.execute('DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY used DESC LIMIT ?)', (self.size,))
+        except sqlite3.Error:
+            pass
+
+
+shared_cache = SharedCache()
+
+
+def memoize(app, key, cache=shared_cache):
+    # caches json responses of a dash callback (put it above @app.callback) keyed by the callback name
+    # and key(*args), which names the data the response is built from; hits are sent as they are stored,
+    # so repeat views are neither decoded nor encoded again
+    def decorator(callback):
+        callback_id = next(name for name, spec in app.callback_map.items() if spec.get('callback') is callback)
+
+        @functools.wraps(callback)
+        def wrapper(*args, outputs_list=None):
+            cache_key = json.dumps([callback.__name__, key(*args)])
+            response = cache.get(cache_key)
+            cache_requests_total.labels(callback.__name__, 'miss' if response is None else 'hit').inc()
+            if response is None:
+                # callbacks without an update raise PreventUpdate, which is not cached
+                response = callback(*args, outputs_list=outputs_list or split_callback_id(callback_id))
+                cache.set(cache_key, response)
+            return response
+
+        # dash calls the callback from its map
+        app.callback_map[callback_id]['callback'] = wrapper
+        return wrapper
+
+    return decorator
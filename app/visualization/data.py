@@ -1,70 +1,348 @@
-import os
-import urllib
-from bidict import bidict
+import sqlite3
+import threading
+from contextlib import closing
+from collections import OrderedDict
+from collections.abc import Mapping
 
 import time
-import datetime
 
+import numpy as np
 import pandas as pd
 
 try:
-    from app.parsing import update_data # in heroku
-except:
-    from parsing import update_data # locally
+    from app.store import store_path, month_names, topics_days # in heroku
+    from app.plane import Plane, build_arrays, store_version, day_dtype
+    from app.visualization import startup
+except ImportError:
+    from store import store_path, month_names, topics_days # locally
+    from plane import Plane, build_arrays, store_version, day_dtype
+    import startup
 
 
 # GLOBAL VARS
-years = [year for year in range(2015, 2021)]
+# compact dtypes of loaded counts, day_dtype is shared with the data plane
+month_dtype = np.uint32
+month_labels = pd.CategoricalDtype(month_names, ordered=True)
 
-data_url = 'https://susice.tritius.cz/statistics'
-topics_days = ['access', 'login', 'search']
-topics_months = ['rating', 'summary']
+# how many monthly frames of each topic are kept in memory
+cache_size_months = 4 # years
+
+# how often workers look for data published by the refresh worker
+version_check_interval = 10 # in seconds
+
+
+# DATA LOADING
+# everything is read from the single store written by parsing.py
+
+def read_store(query, params, path=store_path, dtype=None):
+    with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as con:
+        df = pd.read_sql_query(query, con, params=params)
+    # cast here, read_sql_query takes dtype only since pandas 1.3 (requirements.txt pins 1.0.3)
+    return df.astype(dtype) if dtype else df
+
+
+shared_indexes = {}
+
+def shared_index(key, make):
+    # frames of the same shape share one (immutable) index object instead of a copy each
+    index = shared_indexes.get(key)
+    if index is None:
+        index = shared_indexes.setdefault(key, make())
+    return index
+
+
+@startup.first_call('months data')
+def load_months(topic, year=None, path=store_path):
+    # {year: dataframe} for all years or only for the given one
+    query = 'SELECT year, label, heading, place, value FROM months WHERE topic = ?'
+    query += ' AND year = ?' if year else ''
+    df = read_store(query + ' ORDER BY year, month, position', (topic, year) if year else (topic,), path, {'value': month_dtype})
+
+    frames = {}
+    for year, group in df.groupby('year', sort=False):
+        labels = tuple(group['label'].unique())
+        pairs = tuple(dict.fromkeys(zip(group['heading'], group['place'])))
+        index = shared_index(('months', labels), lambda: pd.CategoricalIndex(labels, dtype=month_labels))
+        columns = shared_index(('columns', pairs), lambda: pd.MultiIndex.from_tuples(pairs, names=[None, 'Měsíc']))
+        values = group['value'].to_numpy().reshape(len(labels), len(columns))
+        frames[int(year)] = pd.DataFrame(values, index=index, columns=columns)
+
+    return frames
+
+
+def load_years(topic):
+    return [int(year) for year in read_store('SELECT DISTINCT year FROM months WHERE topic = ? ORDER BY year', (topic,))['year']]
+
+
+class LazyFrames(Mapping):
+    # dict-like access to frames of one topic, which are loaded on first access
+    # and only the most recently used ones are kept
+    def __init__(self, load, keys, size):
+        self.load = load # key -> dataframe, raises KeyError for missing data
+        self.keys_loader = keys # returns all keys in the store
+        self.size = size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock() # data update runs in another thread
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        df = self.load(key)
+
+        with self.lock:
+            self.cache[key] = df
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+        return df
+
+    def __iter__(self):
+        return iter(self.keys_loader())
+
+    def __len__(self):
+        return len(self.keys_loader())
+
+    def invalidate(self, key):
+        # next access loads the frame from the store again
+        with self.lock:
+            self.cache.pop(key, None)
+
+
+def lazy_months(topic):
+    return LazyFrames(lambda year: load_months(topic, year)[year], lambda: load_years(topic), cache_size_months)
+
+
+plane = Plane()
+
+built_arrays = {} # (topics, store) -> (version, arrays), shared by the cube and the series
+built_lock = threading.Lock()
+
+
+@startup.first_call('daily data')
+def load_daily_arrays(topics, path=store_path):
+    # mapped from the data plane when it holds the newest data, else built from the store once per data version
+    version = store_version(path)
+    key = (tuple(topics), path)
+    arrays = plane.get(topics, version, path)
+    if arrays is not None:
+        # the built ones are freed once the cube and the series swap them for the mapped ones
+        with built_lock:
+            built_arrays.pop(key, None)
+        return arrays
+
+    with built_lock:
+        if built_arrays.get(key, (None, None))[0] != version:
+            built_arrays[key] = version, build_arrays(topics, path)
+        return built_arrays[key][1]
+
+
+def plane_written():
+    # True when this worker built daily arrays whose plane has been written since,
+    # the refresh worker publishes a data version before it writes the plane of it
+    with built_lock:
+        built = [(list(topics), path, version) for (topics, path), (version, arrays) in built_arrays.items()]
+    return any(plane.current(topics, version, path) for topics, path, version in built)
+
+
+class DailyCube:
+    # daily counts of all topics in one array shaped (topic, year, month, day),
+    # days missing in short months and in not yet published months are zeroes
+    def __init__(self, topics):
+        self.topics = topics
+        self.years = []
+        self.counts = None # built on first access
+        self.lock = threading.Lock()
+
+    def load(self, path=store_path):
+        arrays = load_daily_arrays(self.topics, path)
+        # arrays are swapped whole, readers never see a half updated one
+        self.years, self.counts = arrays['years'].tolist(), arrays['cube']
+
+    def get_counts(self):
+        with self.lock:
+            if self.counts is None:
+                self.load()
+        return self.years, self.counts
+
+    def reload(self):
+        with self.lock:
+            if self.counts is not None:
+                self.load()
+
+    def month(self, year, month):
+        # (topic, day) counts of one month
+        years, counts = self.get_counts()
+        if year not in years:
+            return np.zeros((len(self.topics), 31), dtype=day_dtype)
+        return counts[:, years.index(year), month - 1]
+
+    def year(self, year):
+        # (topic, month, day) counts of one year
+        years, counts = self.get_counts()
+        if year not in years:
+            return np.zeros((len(self.topics), 12, 31), dtype=day_dtype)
+        return counts[:, years.index(year)]
+
+    def span(self, start, end):
+        # (topic, month, day) counts of months from start to end (both included), given as (year, month),
+        # months of years missing in the store (or of an empty one) are zeroes
+        years, counts = self.get_counts()
+        months = np.arange(start[0] * 12 + start[1] - 1, end[0] * 12 + end[1])
+        stored = np.isin(months // 12, years)
+        span = np.zeros((len(self.topics), len(months), 31), dtype=day_dtype)
+        span[:, stored] = counts[:, np.searchsorted(years, months[stored] // 12), months[stored] % 12]
+        return span
+
+    def monthly_totals(self):
+        # (topic, year, month) sums, together with the years
+        years, counts = self.get_counts()
+        return years, counts.sum(axis=3, dtype=np.uint64)
+
+
+class DailySeries:
+    # daily counts of all topics indexed by real dates, only the days the store has,
+    # dates are sorted, so any date range is found by binary search
+    def __init__(self, topics):
+        self.topics = topics
+        self.data = None # (dates, (topic, day) counts), built on first access
+        self.lock = threading.Lock()
+
+    def load(self, path=store_path):
+        arrays = load_daily_arrays(self.topics, path)
+        # swapped whole, readers never see a half updated series
+        self.data = arrays['dates'], arrays['series']
+
+    def get(self):
+        with self.lock:
+            if self.data is None:
+                self.load()
+        return self.data
+
+    def reload(self):
+        with self.lock:
+            if self.data is not None:
+                self.load()
+
+    def range(self, start, end):
+        # dates and (topic, day) counts from start to end (both included), given as dates or 'YYYY-MM-DD'
+        dates, counts = self.get()
+        first = np.searchsorted(dates, np.datetime64(start, 'D'))
+        last = np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+        return dates[first:last], counts[:, first:last]
+
+    def month(self, year, month):
+        first = np.datetime64(f'{year}-{month:02d}', 'M')
+        return self.range(first, (first + 1).astype('datetime64[D]') - 1)
+
+    def year(self, year):
+        return self.range(f'{year}-01-01', f'{year}-12-31')
+
+    def last(self, days):
+        # the newest days
+        dates, counts = self.get()
+        if not len(dates):
+            return dates, counts
+        return self.range(dates[-1] - (days - 1), dates[-1])
+
+
+def weekdays(dates):
+    # 0 is monday
+    return (dates.astype('datetime64[D]').astype('int64') + 3) % 7 # 1970-01-01 was thursday
+
+
+def to_list(values, cast=float):
+    # plain list of an array, NaN is not valid json
+    return [None if np.isnan(value) else cast(value) for value in np.asarray(values, dtype=float).tolist()]
 
 
 # DATA
-    # monthly
-summary = {
-    year: pd.read_csv(os.path.join('data', 'months', f'summary_{year}.csv'), header=[0,1], index_col=0)
-    for year in years
-}
-rating = {
-    year: pd.read_csv(os.path.join('data', 'months', f'rating_{year}.csv'), header=[0,1], index_col=0)
-    for year in years
-}
-
-    # daily
-access = {
-    f'{year}:{month}': pd.read_csv(os.path.join('data', 'days', f'{year}', f'access_{year}_{month}.csv'), index_col=0)
-    for year in years
-    for month in range(1,13)
-}
-login = {
-    f'{year}:{month}': pd.read_csv(os.path.join('data', 'days', f'{year}', f'login_{year}_{month}.csv'), index_col=0)
-    for year in years
-    for month in range(1,13)
-}
-search = {
-    f'{year}:{month}': pd.read_csv(os.path.join('data', 'days', f'{year}', f'search_{year}_{month}.csv'), index_col=0)
-    for year in years
-    for month in range(1,13)
-}
-
-
-# PERIODIC DATA UPDATE
-def update_library_data():
-    while True:
-        date = datetime.datetime.now()
-        year = date.year
-        month = date.month
-
-        update_data(data_url, topics_days, topics_months, year, month)
-
-        # monthly data update
-        summary[year] = pd.read_csv(os.path.join('data', 'months', f'summary_{year}.csv'), header=[0,1], index_col=0)
-        rating[year] = pd.read_csv(os.path.join('data', 'months', f'rating_{year}.csv'), header=[0,1], index_col=0)
-        # daily data update
-        access[f'{year}:{month}'] = pd.read_csv(os.path.join('data', 'days', f'{year}', f'access_{year}_{month}.csv'), index_col=0)
-        login[f'{year}:{month}'] = pd.read_csv(os.path.join('data', 'days', f'{year}', f'login_{year}_{month}.csv'), index_col=0)
-        search[f'{year}:{month}'] = pd.read_csv(os.path.join('data', 'days', f'{year}', f'search_{year}_{month}.csv'), index_col=0)
-
-        time.sleep(60 * 60) # in seconds
+    # monthly, keyed by year
+summary = lazy_months('summary')
+rating = lazy_months('rating')
+
+    # daily, in topics_days order
+daily = DailyCube(topics_days)
+series = DailySeries(topics_days)
+
+
+# YEAR PAYLOAD
+def year_payload(year):
+    # everything the month slider switches between, sent to the browser once per year as plain lists
+    # summary rows are [search, access, login] by place, rating rows are [contributions, stars] (null if missing),
+    # daily counts are in topics_days order
+    df = summary[year].loc[:, ['Vyhledávání', 'Přístupy', 'Statistiky přihlášování']]
+    ratings = rating.get(year)
+    if ratings is not None:
+        ratings = ratings.reindex(df.index).loc[:, [('Hodnocení - příspěvky', 'Vše'), ('Hodnocení - hvězdičky', 'Vše')]]
+        ratings = [to_list(row, int) for row in ratings.to_numpy(dtype=float)]
+
+    dates, counts = series.year(year)
+
+    return {
+        'year': year,
+        'months': [month_names.index(label) + 1 for label in df.index],
+        'labels': list(df.index),
+        'places': [place for heading, place in df.columns[:3]],
+        'summary': df.to_numpy().tolist(),
+        'rating': ratings or [[None, None] for label in df.index],
+        'dates': dates.astype(str).tolist(),
+        'weekdays': weekdays(dates).tolist(),
+        'counts': counts.tolist(),
+    }
+
+
+# DATA VERSIONS
+class DataVersions:
+    # versions of the store partitions, the refresh worker bumps them when their data change
+    def __init__(self, interval, path=store_path):
+        self.interval = interval
+        self.path = path
+        self.partitions = {} # (topic, year, month) -> version, month is 0 for months data
+        self.version = None # the newest one
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def check(self):
+        # returns partitions changed since the last check, at most once per interval
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked < self.interval:
+                return []
+            self.checked = now
+
+            df = read_store('SELECT topic, year, month, version FROM partitions WHERE version > ?', (self.version or 0,), self.path)
+            changed = [(topic, int(year), int(month)) for topic, year, month in zip(df['topic'], df['year'], df['month'])]
+            self.partitions.update(zip(changed, [int(version) for version in df['version']]))
+
+            first = self.version is None
+            self.version = max(self.partitions.values(), default=0)
+            # nothing is loaded before the first check
+            return [] if first else changed
+
+    def get(self, topic, year, month=0):
+        # version of one partition, month is 0 for months data
+        return self.partitions.get((topic, year, month), 0)
+
+    def get_days(self, year, month):
+        # version of one month of the daily data of all topics
+        return max(self.get(topic, year, month) for topic in topics_days)
+
+
+versions = DataVersions(version_check_interval)
+
+
+def reload_changed_data():
+    # runs before each request, so all requests of one worker see the same data
+    checked = versions.checked
+    changed = versions.check()
+    for topic, year, month in changed:
+        if month == 0: # monthly data update
+            {'summary': summary, 'rating': rating}[topic].invalidate(year)
+
+    # daily data update, or their plane written after this worker built them (looked for with the versions)
+    if any(month for topic, year, month in changed) or (versions.checked != checked and plane_written()):
+        daily.reload()
+        series.reload()
@@ -0,0 +1,83 @@
+try:
+    from app.visualization.data import summary, read_store, versions, topics_days # in heroku
+    from app.visualization.app import app
+except ImportError:
+    from data import summary, read_store, versions, topics_days # locally
+    from app import app
+
+import pandas as pd
+from flask import Response, abort, request
+
+
+# GLOBAL VARS
+topic_names = {'access': 'Přístupy', 'login': 'Přihlášení', 'search': 'Vyhledávání'}
+
+mimetypes = {
+    'csv': 'text/csv; charset=utf-8',
+    'html': 'text/html; charset=utf-8',
+}
+
+max_age = 5 * 60 # in seconds, ETag tells browsers whether the data changed since
+
+
+# DATA EXPORTS
+# every export is a generator of text chunks, one chunk per year
+
+def load_days_year(year):
+    # daily counts of all topics in one frame indexed by month and day
+    df = read_store('SELECT month, day, topic, count FROM days WHERE year = ?', (year,))
+    df = df.set_index(['month', 'day', 'topic'])['count'].unstack('topic', fill_value=0)
+
+    df = df.reindex(columns=topics_days, fill_value=0).rename(columns=topic_names)
+    df.index.names = ['Měsíc', 'Den']
+    df.columns.name = None
+    return df
+
+
+def export_summary(years, fmt):
+    for i, year in enumerate(years):
+        df = summary[year]
+        if len(years) > 1:
+            df = pd.concat({year: df}, names=['Rok'])
+
+        if fmt == 'csv':
+            yield df.to_csv(index=True, header=i == 0)
+        else:
+            yield (f'<h2>{year}</h2>\n' if len(years) > 1 else '') + df.to_html(index=True)
+
+
+def export_days(years, fmt):
+    for i, year in enumerate(years):
+        df = pd.concat({year: load_days_year(year)}, names=['Rok'])
+
+        if fmt == 'csv':
+            yield df.to_csv(index=True, header=i == 0)
+        else:
+            yield (f'<h2>{year}</h2>\n' if len(years) > 1 else '') + df.to_html(index=True)
+
+
+exports = {
+    'summary': (export_summary, lambda year: versions.get('summary', year)),
+    'days': (export_days, lambda year: max(versions.get_days(year, month) for month in range(1, 13))),
+}
+
+
+# DOWNLOAD ROUTE
+# e.g. /download/summary/2019.csv, /download/days/all.html
+@app.server.route('/download/<dataset>/<period>.<fmt>')
+def download(dataset, period, fmt):
+    if dataset not in exports or fmt not in mimetypes:
+        abort(404)
+
+    years = list(summary) if period == 'all' else [int(period)] if period.isdigit() else []
+    if not years or any(year not in summary for year in years):
+        abort(404)
+
+    export, version = exports[dataset]
+    response = Response(export(years, fmt), mimetype=mimetypes[fmt])
+
+    # data of a year change only with their version, so the version identifies the content
+    response.set_etag(f'{dataset}-{period}-' + '-'.join(str(version(year)) for year in years))
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
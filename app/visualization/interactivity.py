@@ -1,32 +1,35 @@
-from data import summary, rating, access, login, search
-from app import app
-
-import urllib
-
+try:
+    from app.visualization.data import summary, rating, series, weekdays, to_list, month_names, versions, year_payload, reload_changed_data # in heroku
+    from app.visualization.rollups import rollups, places
+    from app.visualization.cache import memoize, shared_cache
+    from app.visualization.app import app
+except ImportError:
+    from data import summary, rating, series, weekdays, to_list, month_names, versions, year_payload, reload_changed_data # locally
+    from rollups import rollups, places
+    from cache import memoize, shared_cache
+    from app import app
+
+import numpy as np
+
+import json
+import threading
+
+try:
+    import fcntl
+except ImportError: # windows, where only the local server runs
+    fcntl = None
+
+import dash
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
 
 
 # GLOBAL VARS
-months = bidict({
-    'Leden': 1,
-    'Únor': 2,
-    'Březen': 3,
-    'Duben': 4,
-    'Květen': 5,
-    'Červen': 6,
-    'Červenec': 7,
-    'Srpen': 8,
-    'Září': 9,
-    'Říjen': 10,
-    'Listopad': 11,
-    'Prosinec': 12,
-    'Souhrnně celkem': 13
-})
-
 width_breakpoint = 1000
 
+weekday_names = ['Po', 'Út', 'St', 'Čt', 'Pá', 'So', 'Ne']
+
 
 # GET PAGE WIDTH
 app.clientside_callback(
@@ -40,6 +43,16 @@ app.clientside_callback(
 )
 
 
+# DATA VERSION
+# changes only when the refresh worker published new data, callbacks depending on it then run again
+@app.callback(
+    Output('data_version', 'data'),
+    [Input('interval_version', 'n_intervals')],
+    [State('data_version', 'data')])
+def update_data_version(n, version):
+    return versions.version if versions.version != version else dash.no_update
+
+
 # POPUP CLOSE BUTTON
 @app.callback(
     Output('modal', 'is_open'),
@@ -49,159 +62,264 @@ def toggle_modal(n):
     return False if n else True
 
 
-# UPDATE SLIDER
+# UPDATE YEAR DATA
+# one payload per year (see year_payload in data.py), the month slider then switches in the browser only
+def days_versions(year, month):
+    # 13. month is data for whole year
+    return [versions.get_days(year, month) for month in (range(1, 13) if month == 13 else [month])]
+
+
+@memoize(app, lambda year, version: [year, versions.get('summary', year), versions.get('rating', year)] + days_versions(year, 13))
 @app.callback(
-    [Output('slider_month', 'marks'),
-    Output('slider_month', 'value')],
+    Output('year_data', 'data'),
     [Input('radio_year', 'value'),
-    Input('size', 'children')])
-def update_slider(year, width):
-    month_slice = slice(0, 3) if int(width) < width_breakpoint else slice(0, None)
-    rotation = 'translateX(-25px) translateY(10px) rotate(-45deg)' if int(width) < width_breakpoint else 'rotate(0deg) translateX(-15px)'
+    Input('data_version', 'data')])
+def update_year_data(year, version):
+    return year_payload(year)
 
-    return (
-        {
-            months[month]: 
-            {
-                'label': month[month_slice] if month != 'Souhrnně celkem' else 'Souhrnně',
-                'style': {'color': '#ffffff' if month != 'Souhrnně celkem' else '#2ca02c', 'fontSize': '1.15em', 'transform': rotation}
+
+# clientside callbacks below get width_breakpoint and weekday_names from here
+def clientside(function):
+    return function % {'width_breakpoint': width_breakpoint, 'weekday_names': json.dumps(weekday_names, ensure_ascii=False)}
+
+
+# UPDATE SLIDER
+app.clientside_callback(
+    clientside('''
+    function(data, width, value, shown) {
+        if (!data) {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update, window.dash_clientside.no_update]
+        }
+        var small = parseInt(width) < %(width_breakpoint)d
+        var rotation = small ? 'translateX(-25px) translateY(10px) rotate(-45deg)' : 'rotate(0deg) translateX(-15px)'
+
+        var marks = {}
+        data.months.forEach(function(month, i) {
+            marks[month] = {
+                'label': month != 13 ? (small ? data.labels[i].slice(0, 3) : data.labels[i]) : 'Souhrnně',
+                'style': {'color': month != 13 ? '#ffffff' : '#2ca02c', 'fontSize': '1.15em', 'transform': rotation}
             }
-            for month in summary[year].index.unique()
-        },
+        })
 
-        months[summary[year].index.unique()[0]]
-    )
+        // keep the chosen month when only the data changed
+        var keep = String(data.year) == shown && data.months.indexOf(value) >= 0
+        return [marks, keep ? value : data.months[0], String(data.year)]
+    }
+    '''),
+    [Output('slider_month', 'marks'),
+    Output('slider_month', 'value'),
+    Output('slider_year', 'children')],
+    [Input('year_data', 'data'),
+    Input('size', 'children')],
+    [State('slider_month', 'value'),
+    State('slider_year', 'children')]
+)
 
 
-# UPDATE GRAPH SUMMARY DAILY
-@app.callback(
-    Output('graph_summary_daily', 'figure'),
-    [Input('radio_year', 'value'),
-    Input('slider_month', 'value'),
-    Input('size', 'children')])
-def update_figure_daily(year, month, width):
-    # 13. month is data for whole year, which is not availible for concrete days
-    # so we set month and year on January 2015 which is all zeroes
-    if month == 13:
-        year = 2015
-        month = 1
-
-    acc = access[f'{year}:{month}']
-    log = login[f'{year}:{month}']
-    ser = search[f'{year}:{month}']
+def bars_daily(dates, counts, x):
+    acc, log, ser = counts.tolist()
+    hover = [weekday_names[weekday] for weekday in weekdays(dates)]
 
-    data = [
+    return [
         {
         'type': 'bar', 'name': 'Vyhledávání',
-        'x': [f'{day}' for day in range(1,32)],
-        'y': [ser.loc[day][0] if day <= len(ser.index) else 0 for day in range(1,32)]
+        'x': x, 'y': ser, 'hovertext': hover
         },
 
         {
         'type': 'bar', 'name': 'Přístupy',
-        'x': [f'{day}' for day in range(1,32)],
-        'y': [acc.loc[day][0] if day <= len(acc.index) else 0 for day in range(1,32)]
+        'x': x, 'y': acc, 'hovertext': hover
         },
 
         {
         'type': 'bar', 'name': 'Přihlášení',
-        'x': [f'{day}' for day in range(1,32)],
-        'y': [log.loc[day][0] if day <= len(log.index) else 0 for day in range(1,32)]
+        'x': x, 'y': log, 'hovertext': hover
         },
     ]
 
-    graph_columns = 10 if int(width) < width_breakpoint else 31
-    graph_height = 400 if int(width) < width_breakpoint else 600
 
-    return {
-        'data': data,
-        'layout': dict(
-            xaxis={'range': [0, graph_columns], 'linecolor': '2b3e50', 'tickmode': 'linear'},
-            yaxis={'range': [0, 200]},
-            margin={'l': 30, 'b': 25, 't': 0, 'r': 10, 'pad': 0},
-            legend={'xanchor': 'center', 'yanchor': 'top', 'y': 1.3, 'x': 0.5 },
-            transition={'duration': 500}, # ugly efect when rescaling axis
-            height=graph_height,
-            plot_bgcolor='#2b3e50',
-            paper_bgcolor='#2b3e50',
-            font={'color': '#ffffff'},
-            dragmode='orbit',
-        )   
+# UPDATE GRAPH SUMMARY DAILY
+# the same figure as bars_daily builds, from the days of the year payload
+app.clientside_callback(
+    clientside('''
+    function(data, month, width) {
+        if (!data || !month) {
+            return window.dash_clientside.no_update
+        }
+        var small = parseInt(width) < %(width_breakpoint)d
+        var weekdayNames = %(weekday_names)s
+
+        // 13. month is data for whole year, shown day by day
+        var days = []
+        data.dates.forEach(function(date, i) {
+            if (month == 13 || parseInt(date.slice(5, 7)) == month) {
+                days.push(i)
+            }
+        })
+        var pick = function(values) {
+            return days.map(function(i) { return values[i] })
+        }
+
+        var x, xaxis
+        if (month == 13) {
+            x = pick(data.dates)
+            xaxis = {'linecolor': '2b3e50', 'type': 'date'}
+        } else {
+            x = days.map(function(i, day) { return String(day + 1) })
+            xaxis = {'range': [0, small ? 10 : days.length], 'linecolor': '2b3e50', 'tickmode': 'linear'}
+        }
+
+        var hover = days.map(function(i) { return weekdayNames[data.weekdays[i]] })
+        var bar = function(name, counts) {
+            return {'type': 'bar', 'name': name, 'x': x, 'y': pick(counts), 'hovertext': hover}
+        }
+
+        return {
+            'data': [bar('Vyhledávání', data.counts[2]), bar('Přístupy', data.counts[0]), bar('Přihlášení', data.counts[1])],
+            'layout': {
+                'xaxis': xaxis,
+                'yaxis': {'range': [0, 200]},
+                'margin': {'l': 30, 'b': 25, 't': 0, 'r': 10, 'pad': 0},
+                'legend': {'xanchor': 'center', 'yanchor': 'top', 'y': 1.3, 'x': 0.5 },
+                'transition': {'duration': 500}, // ugly efect when rescaling axis
+                'height': small ? 400 : 600,
+                'plot_bgcolor': '#2b3e50',
+                'paper_bgcolor': '#2b3e50',
+                'font': {'color': '#ffffff'},
+                'dragmode': 'orbit'
+            }
+        }
     }
+    '''),
+    Output('graph_summary_daily', 'figure'),
+    [Input('year_data', 'data'),
+    Input('slider_month', 'value'),
+    Input('size', 'children')]
+)
 
 
-# UPDATE GRAPH SUMMARY MONTHLY
+# UPDATE DATE RANGE
+# presets count back from the newest day in the store,
+# new data only move the allowed dates, so a range picked by the user stays
 @app.callback(
-    Output('graph_summary_monthly', 'figure'),
-    [Input('radio_year', 'value'),
-    Input('slider_month', 'value'),
-    Input('size', 'children')])
-def update_figure_monthly(year, month, width):
-    df = summary[year]
-    filt = df.loc[months.inverse[month]]
-
-    # filt.loc['Vyhledávání'][0] is the same as filt.loc['Vyhledávání', 'V knihovně'] is the same as filt[0]
-    # filt.loc['Přístupy'][2] is the same as filt.loc['Přístupy', 'Vše'] is the same as filt[5]
-    search = [filt.loc['Vyhledávání', 'V knihovně'], filt.loc['Vyhledávání', 'Mimo knihovnu'], filt.loc['Vyhledávání', 'Vše']]
-    access = [filt.loc['Přístupy', 'V knihovně'], filt.loc['Přístupy', 'Mimo knihovnu'], filt.loc['Přístupy', 'Vše']]
-    login = [filt.loc['Statistiky přihlášování', 'V knihovně'], filt.loc['Statistiky přihlášování', 'Mimo knihovnu'], filt.loc['Statistiky přihlášování', 'Vše']]
-    data = [
-        {
-        'type': 'bar', 'name': 'Vyhledávání',
-        'y': [df.columns[0][1], df.columns[1][1], df.columns[2][1]],
-        'x': search,
-        'orientation': 'h', 'hoverinfo':'skip',
-        'text': search, 'textposition': 'outside'
-        },
+    [Output('date_range', 'start_date'),
+    Output('date_range', 'end_date')],
+    [Input('radio_range', 'value')],
+    [State('data_version', 'data')])
+def update_date_range(days, version):
+    last, _ = series.last(days)
+    if not len(last):
+        return None, None
+    return str(last[0]), str(last[-1])
 
-        {
-        'type': 'bar', 'name': 'Přístupy',
-        'y': [df.columns[0][1], df.columns[1][1], df.columns[2][1]],
-        'x': access,
-        'orientation': 'h', 'hoverinfo':'skip',
-        'text': access, 'textposition': 'outside'
-        },
 
-        {
-        'type': 'bar', 'name': 'Přihlášení',
-        'y': [df.columns[0][1], df.columns[1][1], df.columns[2][1]],
-        'x': login,
-        'orientation': 'h', 'hoverinfo':'skip',
-        'text': login, 'textposition': 'outside'
-        }
-    ]
+@app.callback(
+    [Output('date_range', 'min_date_allowed'),
+    Output('date_range', 'max_date_allowed')],
+    [Input('data_version', 'data')])
+def update_date_range_allowed(version):
+    dates, counts = series.get()
+    if not len(dates):
+        return None, None
+    return str(dates[0]), str(dates[-1])
+
+
+# UPDATE GRAPH DATE RANGE
+@memoize(app, lambda start, end, version: [start, end, versions.version])
+@app.callback(
+    Output('graph_range', 'figure'),
+    [Input('date_range', 'start_date'),
+    Input('date_range', 'end_date'),
+    Input('data_version', 'data')])
+def update_figure_range(start, end, version):
+    if not start or not end:
+        return dash.no_update
+    return make_figure_range(start[:10], end[:10])
 
-    max_range = 4500
-    changed = False
-    if filt[2] > max_range or filt[5] > max_range or filt[8] > max_range:
-        max_range = max(filt[2], filt[5], filt[8]) * 1.1 # 1.1 for labels to be visible
-        changed = True
 
-    graph_height = 400 if int(width) < width_breakpoint else 600
+def make_figure_range(start, end):
+    dates, counts = series.range(start, end)
 
     return {
-        'data': data,
+        'data': bars_daily(dates, counts, dates.astype(str).tolist()),
         'layout': dict(
-            yaxis={'linecolor': '2b3e50'},
-            xaxis={'range': [0, max_range]},
-            margin={'l': 85, 'b': 0, 't': 0, 'r': 0, 'pad': 0},
-            legend={'xanchor':'center', 'yanchor':'top', 'y':1.2, 'x':0.25 },
-            transition={'duration': 0 if changed else 500}, # ugly efect when rescaling axis
-            height=graph_height,
+            barmode='stack',
+            xaxis={'linecolor': '2b3e50', 'type': 'date'},
+            margin={'l': 40, 'b': 25, 't': 0, 'r': 10, 'pad': 0},
+            legend={'orientation': 'h', 'xanchor': 'center', 'yanchor': 'bottom', 'y': 1.02, 'x': 0.5},
+            height=400,
             plot_bgcolor='#2b3e50',
             paper_bgcolor='#2b3e50',
             font={'color': '#ffffff'},
-            dragmode=False
         )
     }
 
 
+# UPDATE GRAPH SUMMARY MONTHLY
+app.clientside_callback(
+    clientside('''
+    function(data, month, width) {
+        var i = data ? data.months.indexOf(month) : -1
+        if (i < 0) {
+            return window.dash_clientside.no_update
+        }
+        var small = parseInt(width) < %(width_breakpoint)d
+
+        var row = data.summary[i]
+        var search = row.slice(0, 3), access = row.slice(3, 6), login = row.slice(6, 9)
+        var bar = function(name, values) {
+            return {
+                'type': 'bar', 'name': name,
+                'y': data.places,
+                'x': values,
+                'orientation': 'h', 'hoverinfo': 'skip',
+                'text': values, 'textposition': 'outside'
+            }
+        }
+
+        var maxRange = 4500
+        var changed = false
+        if (Math.max(search[2], access[2], login[2]) > maxRange) {
+            maxRange = Math.max(search[2], access[2], login[2]) * 1.1 // 1.1 for labels to be visible
+            changed = true
+        }
+
+        return {
+            'data': [bar('Vyhledávání', search), bar('Přístupy', access), bar('Přihlášení', login)],
+            'layout': {
+                'yaxis': {'linecolor': '2b3e50'},
+                'xaxis': {'range': [0, maxRange]},
+                'margin': {'l': 85, 'b': 0, 't': 0, 'r': 0, 'pad': 0},
+                'legend': {'xanchor': 'center', 'yanchor': 'top', 'y': 1.2, 'x': 0.25 },
+                'transition': {'duration': changed ? 0 : 500}, // ugly efect when rescaling axis
+                'height': small ? 400 : 600,
+                'plot_bgcolor': '#2b3e50',
+                'paper_bgcolor': '#2b3e50',
+                'font': {'color': '#ffffff'},
+                'dragmode': false
+            }
+        }
+    }
+    '''),
+    Output('graph_summary_monthly', 'figure'),
+    [Input('year_data', 'data'),
+    Input('slider_month', 'value'),
+    Input('size', 'children')]
+)
+
+
 # UPDATE DATA TABLE
+@memoize(app, lambda year, version: [year, versions.get('summary', year), versions.get('rating', year)])
 @app.callback(
     [Output('table_summary', 'children'),
     Output('table_rating', 'children')],
-    [Input('radio_year', 'value')])
-def update_tables(year):
+    [Input('radio_year', 'value'),
+    Input('data_version', 'data')])
+def update_tables(year, version):
+    return make_tables(year)
+
+
+def make_tables(year):
     table_summary = dbc.Table.from_dataframe(summary[year], striped=True, borderless=True, index=True, responsive=True)
     table_rating = dbc.Table.from_dataframe(rating[year], striped=True, borderless=True, index=True, responsive=True)
 
@@ -242,46 +360,117 @@ def update_tables(year):
     return table_summary, table_rating
 
 
-# UPDATE RATING
-@app.callback(
-    Output('rating', 'children'),
-    [Input('radio_year', 'value'),
-    Input('slider_month', 'value')])
-def update_rating(year, month):
-    df = rating[year]
+def warm_tables():
+    # tables of past years never change, so they are built once for all workers on the machine,
+    # by the worker which gets the lock, the others find them in the shared cache
+    # and after a data update only the tables of the updated year are built again
+    with open(f'{shared_cache.path}.lock', 'a') as lock:
+        if fcntl:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError: # another worker is warming them
+                return
 
-    rating_contrib = df.loc[months.inverse[month], 'Hodnocení - příspěvky']['Vše']
-    rating_stars = df.loc[months.inverse[month], 'Hodnocení - hvězdičky']['Vše']
+        reload_changed_data()
+        for year in summary:
+            update_tables(year, versions.version)
 
-    return (
-        html.Div(f'Hodnocení - příspěvky: {rating_contrib}', style={'textAlign': 'center'}), 
-        html.Div(f'Hodnocení - hvězdičky: {rating_stars}', style={'textAlign': 'center'})   
-    )
 
+warming = threading.Thread(target=warm_tables, daemon=True)
+warming.start()
 
-# UPDATE DOWNLOAD CSV LINK
-@app.callback(
-    [Output('link_download_csv', 'download'),
-    Output('link_download_csv', 'href')],
-    [Input('radio_year', 'value'),
-    Input('slider_month', 'value')])
-def update_download_link_csv(year, month):
-    filt = summary[year]
-    csv_string = filt.to_csv(index=True, encoding='utf-8')
-    csv_string = 'data:text/csv;charset=utf-8,' + urllib.parse.quote(csv_string)
 
-    return f'summary_{year}.csv', csv_string
+# UPDATE RATING
+app.clientside_callback(
+    '''
+    function(data, month) {
+        var i = data ? data.months.indexOf(month) : -1
+        if (i < 0) {
+            return [window.dash_clientside.no_update, window.dash_clientside.no_update]
+        }
+        var contrib = data.rating[i][0], stars = data.rating[i][1]
+        return [
+            contrib === null ? '' : 'Hodnocení - příspěvky: ' + contrib,
+            stars === null ? '' : 'Hodnocení - hvězdičky: ' + stars
+        ]
+    }
+    ''',
+    [Output('rating_contrib', 'children'),
+    Output('rating_stars', 'children')],
+    [Input('year_data', 'data'),
+    Input('slider_month', 'value')]
+)
 
 
-# UPDATE DOWNLOAD HTML LINK
+# UPDATE GRAPH TREND
+@memoize(app, lambda trend, place, year, version: [trend, place, year, versions.version])
 @app.callback(
-    [Output('link_download_html', 'download'),
-    Output('link_download_html', 'href')],
-    [Input('radio_year', 'value'),
-    Input('slider_month', 'value')])
-def update_download_link_html(year, month):
-    filt = summary[year]
-    html_string = filt.to_html(index=True)
-    html_string = 'data:text/csv;charset=utf-8,' + urllib.parse.quote(html_string)
+    Output('graph_trend', 'figure'),
+    [Input('radio_trend', 'value'),
+    Input('radio_place', 'value'),
+    Input('radio_year', 'value'),
+    Input('data_version', 'data')])
+def update_figure_trend(trend, place, year, version):
+    return make_figure_trend(trend, place, year)
+
+
+def make_figure_trend(trend, place, year):
+    # all arrays come precomputed from the rollups, see rollups.py
+    tables = rollups.get()
+    years = tables['years']
+    names = {'access': 'Přístupy', 'login': 'Přihlášení', 'search': 'Vyhledávání'}
+    order = [rollups.topics.index(topic) for topic in ['search', 'access', 'login']]
+
+    if trend in ['totals', 'totals_delta']:
+        x = [f'{year}' for year in years]
+        ys = [tables[trend][topic, place] for topic in order]
+    elif trend in ['rolling', 'month_delta']:
+        x = [f'{year}-{month:02d}' for year in years for month in range(1, 13)]
+        ys = [tables[trend][topic, place].ravel() for topic in order]
+    elif trend == 'year_delta':
+        x = month_names[:12]
+        ys = [tables[trend][topic, place, years.index(year)] if year in years else np.full(12, np.nan) for topic in order]
+    else: # weekdays, days are not split by place
+        x = weekday_names
+        ys = [tables[trend][topic, years.index(year)] if year in years else np.full(7, np.nan) for topic in order]
+
+    kind = {'type': 'scatter', 'mode': 'lines'} if trend == 'rolling' else {'type': 'bar'}
+    data = [
+        {**kind, 'name': names[rollups.topics[topic]], 'x': x, 'y': to_list(y)}
+        for topic, y in zip(order, ys)
+    ]
 
-    return f'summary_{year}.html', html_string
+    return {
+        'data': data,
+        'layout': dict(
+            yaxis={'title': places[place] if trend != 'weekdays' else 'Průměr za den'},
+            margin={'l': 60, 'b': 40, 't': 10, 'r': 10, 'pad': 0},
+            legend={'orientation': 'h', 'xanchor': 'center', 'yanchor': 'bottom', 'y': 1.02, 'x': 0.5},
+            height=500,
+            plot_bgcolor='#2b3e50',
+            paper_bgcolor='#2b3e50',
+            font={'color': '#ffffff'},
+        )
+    }
+
+
+# UPDATE DOWNLOAD LINKS
+# exports are served by the /download route (see export.py)
+app.clientside_callback(
+    '''
+    function(year) {
+        return [
+            'summary_' + year + '.csv', '/download/summary/' + year + '.csv',
+            'summary_' + year + '.html', '/download/summary/' + year + '.html',
+            'days_' + year + '.csv', '/download/days/' + year + '.csv'
+        ]
+    }
+    ''',
+    [Output('link_download_csv', 'download'),
+    Output('link_download_csv', 'href'),
+    Output('link_download_html', 'download'),
+    Output('link_download_html', 'href'),
+    Output('link_download_days', 'download'),
+    Output('link_download_days', 'href')],
+    [Input('radio_year', 'value')]
+)
@@ -1,10 +1,19 @@
+import os
+
+try:
+    from app.visualization.data import summary, versions # in heroku
+    from app.visualization import startup
+except ImportError:
+    from data import summary, versions # locally
+    import startup
+
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 
 
 # GLOBAL VARS
-init_year = datetime.datetime.now().year
+version_check_interval = 60 # in seconds, how often pages ask for new data
 
 popup_message_path = os.path.join('app', 'assets', 'popup_message.md')
 with open(popup_message_path) as f:
@@ -23,18 +32,22 @@ modal = html.Div([
 
 
 # YEAR PICKER
-year_picker = dbc.FormGroup([
-    dbc.RadioItems(
-        options=[
-            {'label': f'{year}', 'value': year}
-            for year in range(2015, init_year + 1)
-        ],
-        value=init_year,
-        switch=True,
-        inline=True,
-        id='radio_year',
-    ),
-], style={'margin': '25px 0', 'textAlign': 'center'})
+# years in the store, the newest one is chosen
+def make_year_picker():
+    years = list(summary)
+
+    return dbc.FormGroup([
+        dbc.RadioItems(
+            options=[
+                {'label': f'{year}', 'value': year}
+                for year in years
+            ],
+            value=years[-1] if years else None,
+            switch=True,
+            inline=True,
+            id='radio_year',
+        ),
+    ], style={'margin': '25px 0', 'textAlign': 'center'})
 
 
 # VISUALIZATION TAB
@@ -97,7 +110,96 @@ tab_graph = html.Div([
     ], style={'margin': '20px auto'}),
 
     # RATING NUMBERS
-    html.Div(id='rating'),
+    html.Div([
+        html.Div(id='rating_contrib', style={'textAlign': 'center'}),
+        html.Div(id='rating_stars', style={'textAlign': 'center'}),
+    ], id='rating'),
+
+    # GRAPH DATE RANGE
+    dbc.Card([
+        dbc.CardHeader([
+            dcc.Markdown('#### Denní data za období', style={'textAlign': 'center'}),
+            dbc.RadioItems(
+                options=[
+                    {'label': '30 dní', 'value': 30},
+                    {'label': '90 dní', 'value': 90},
+                    {'label': 'Rok', 'value': 365},
+                ],
+                value=90,
+                inline=True,
+                id='radio_range',
+            ),
+            dcc.DatePickerRange(
+                id='date_range',
+                display_format='D. M. YYYY',
+                first_day_of_week=1,
+            ),
+        ], style={'textAlign': 'center'}),
+
+        dbc.CardBody([
+            dcc.Graph(
+                id='graph_range',
+                config={
+                    'displaylogo': False,
+                    'modeBarButtonsToRemove': [
+                        'select2d', 'lasso2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d',
+                        'toggleSpikelines', 'hoverClosestCartesian', 'hoverCompareCartesian'
+                    ],
+                },
+            )
+        ])
+    ], style={'background-color': '#2b3e50', 'border-color': '#3b4c5d', 'border-width': '4px', 'margin': '20px auto'}),
+])
+
+
+# TRENDS TAB
+tab_trends = html.Div([
+    # TREND AND PLACE PICKERS
+    dbc.Row([
+        dbc.Col([
+            dbc.RadioItems(
+                options=[
+                    {'label': 'Roční součty', 'value': 'totals'},
+                    {'label': 'Meziroční změna', 'value': 'totals_delta'},
+                    {'label': 'Měsíce proti loňsku', 'value': 'year_delta'},
+                    {'label': 'Klouzavý průměr', 'value': 'rolling'},
+                    {'label': 'Meziměsíční změna', 'value': 'month_delta'},
+                    {'label': 'Dny v týdnu', 'value': 'weekdays'},
+                ],
+                value='totals',
+                inline=True,
+                id='radio_trend',
+            ),
+        ], className='col-12'),
+        dbc.Col([
+            dbc.RadioItems(
+                options=[
+                    {'label': 'V knihovně', 'value': 0},
+                    {'label': 'Mimo knihovnu', 'value': 1},
+                    {'label': 'Vše', 'value': 2},
+                ],
+                value=2,
+                inline=True,
+                id='radio_place',
+            ),
+        ], className='col-12'),
+    ], style={'margin': '30px auto', 'textAlign': 'center'}),
+
+    # GRAPH TREND
+    dbc.Card([
+        dbc.CardBody([
+            dcc.Graph(
+                id='graph_trend',
+                config={
+                    'displaylogo': False,
+                    'modeBarButtonsToRemove': [
+                        'select2d', 'lasso2d', 'zoomIn2d', 'zoomOut2d', 'autoScale2d',
+                        'toggleSpikelines', 'hoverClosestCartesian', 'hoverCompareCartesian'
+                    ],
+                },
+            )
+        ])
+    ], style={'background-color': '#2b3e50', 'border-color': '#3b4c5d', 'border-width': '4px', 'margin': '20px auto'}),
 ])
 
 
@@ -122,7 +224,24 @@ tab_data = html.Div([
                     download='', href='', target='_blank'
                 ),
             ]),
-        ]),   
+        ]),
+        dbc.Row([
+            # DAILY DATA LINK
+            dbc.Col([
+                html.A(
+                    'Stáhnout denní data [CSV]', id='link_download_days',
+                    download='', href='', target='_blank'
+                ),
+            ]),
+
+            # ALL YEARS LINK
+            dbc.Col([
+                html.A(
+                    'Stáhnout data všech let [CSV]', id='link_download_all',
+                    download='summary_all.csv', href='/download/summary/all.csv', target='_blank'
+                ),
+            ]),
+        ]),
     ], style={'text-align': 'center', 'margin': '25px'}),
 
     # TABLE SUMMARY
@@ -135,17 +254,24 @@ tab_data = html.Div([
 
 
 # LAYOUT DESCRIPTION
+@startup.first_call('layout')
 def make_layout():
     return html.Div([
         # STORES PAGE WIDTH
         html.Div(id='size', style={'display': 'none'}), dcc.Location(id='url'),
+        # STORES DATA VERSION
+        dcc.Store(id='data_version', data=versions.version),
+        dcc.Interval(id='interval_version', interval=version_check_interval * 1000),
+        # STORES DATA OF THE CHOSEN YEAR AND THE YEAR THE MONTH SLIDER SHOWS
+        dcc.Store(id='year_data'), html.Div(id='slider_year', style={'display': 'none'}),
         # POPUP INFO
         modal,
         # YEAR PICKER
-        year_picker,
+        make_year_picker(),
         # TABS
         dbc.Tabs([
             dbc.Tab(tab_graph, label='Vizualizace', tab_style={'width': '200px', 'textAlign': 'center', 'margin': 'auto'}, label_style={'color': '#37b800'}),
+            dbc.Tab(tab_trends, label='Trendy', tab_style={'width': '200px', 'textAlign': 'center', 'margin': 'auto'}, label_style={'color': '#f0ad4e'}),
             dbc.Tab(tab_data, label='Data', tab_style={'width': '200px', 'textAlign': 'center', 'margin': 'auto'}, label_style={'color': '#00AEF9'}),
         ]),
     ])
@@ -0,0 +1,99 @@
+try:
+    from app.metrics import metrics_path, seconds_buckets, bytes_buckets # in heroku
+    from app.visualization.app import app
+except ImportError:
+    from metrics import metrics_path, seconds_buckets, bytes_buckets # locally
+    from app import app
+
+import os
+import re
+import time
+import cProfile
+import itertools
+
+from flask import Response, g, request
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+
+# GLOBAL VARS
+callback_path = '/_dash-update-component'
+
+# profiling is on while this file exists, e.g. `touch data/metrics/profile`
+profile_flag = os.path.join(metrics_path, 'profile')
+profiles_path = os.path.join(metrics_path, 'profiles')
+profile_every = 10 # callback requests, only every n-th one is profiled
+keep_profiles = 50 # files, the oldest ones are removed
+
+callback_seconds = Histogram('dash_callback_seconds', 'Duration of callback requests by the outputs they update', ['callback'], buckets=seconds_buckets)
+response_bytes = Histogram('dash_callback_response_bytes', 'Size of callback responses', ['callback'], buckets=bytes_buckets)
+responses_total = Counter('dash_callback_responses_total', 'Callback responses by status', ['callback', 'status'])
+profiles_total = Counter('dash_callback_profiles_total', 'Callback requests run under the profiler', ['callback'])
+
+server = app.server
+callback_requests = itertools.count()
+
+
+# CALLBACK TIMING
+def callback_name():
+    # outputs of the callback, as dash names them
+    body = request.get_json(silent=True) or {}
+    return body.get('output', 'unknown')
+
+
+@server.before_request
+def start_callback():
+    if request.path != callback_path:
+        return
+
+    g.callback_start = time.perf_counter()
+    if next(callback_requests) % profile_every == 0 and os.path.exists(profile_flag):
+        g.profile = cProfile.Profile()
+        g.profile.enable()
+
+
+@server.after_request
+def record_callback(response):
+    if request.path != callback_path or 'callback_start' not in g:
+        return response
+
+    seconds = time.perf_counter() - g.callback_start
+    name = callback_name()
+
+    profile = g.pop('profile', None)
+    if profile:
+        profile.disable()
+        save_profile(profile, name)
+
+    callback_seconds.labels(name).observe(seconds)
+    response_bytes.labels(name).observe(response.calculate_content_length() or 0)
+    responses_total.labels(name, response.status_code).inc()
+    return response
+
+
+# PROFILING
+def save_profile(profile, name):
+    # stats for `python -m pstats` or snakeviz, named by the callback outputs
+    filename = re.sub(r'[^\w-]+', '_', name).strip('_')[:80]
+    try:
+        os.makedirs(profiles_path, exist_ok=True)
+        profile.dump_stats(os.path.join(profiles_path, f'{filename}-{os.getpid()}-{time.time_ns()}.prof'))
+
+        profiles = sorted(os.listdir(profiles_path), key=lambda entry: int(entry.rsplit('-', 1)[1].split('.')[0]))
+        for old in profiles[:-keep_profiles]:
+            os.remove(os.path.join(profiles_path, old))
+    except (OSError, ValueError, IndexError): # removed by another worker meanwhile
+        return
+
+    profiles_total.labels(name).inc()
+
+
+# PROMETHEUS ROUTE
+# under gunicorn the samples of all workers and the refresh worker added up, otherwise this process only
+@server.route('/metrics')
+def serve_metrics():
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
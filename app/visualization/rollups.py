@@ -0,0 +1,124 @@
+try:
+    from app.visualization.data import read_store, load_years, daily, versions, weekdays, topics_days # in heroku
+except ImportError:
+    from data import read_store, load_years, daily, versions, weekdays, topics_days # locally
+
+import threading
+
+import numpy as np
+
+
+# GLOBAL VARS
+# summary table headings of the daily topics
+headings = {'Přístupy': 'access', 'Statistiky přihlášování': 'login', 'Vyhledávání': 'search'}
+places = ['V knihovně', 'Mimo knihovnu', 'Vše']
+
+rolling_months = 3
+
+
+# CALENDAR
+def calendar(year):
+    # weekday (0 is monday) of each (month, day) of the year and whether the month has the day
+    first = np.datetime64(f'{year}-01', 'M') + np.arange(12)
+    days = first.astype('datetime64[D]')[:, None] + np.arange(31)
+    valid = days.astype('datetime64[M]') == first[:, None]
+    return weekdays(days), valid
+
+
+# ROLLUPS
+class Rollups:
+    # aggregates over all years for the trend view, computed at first use
+    # and then again only for the years whose partitions got a new version
+    # arrays are shaped (topic, place, year, month) or (topic, place, year), not published months are NaN
+    def __init__(self, topics=topics_days):
+        self.topics = topics
+        self.version = None # data version the tables are computed for
+        self.built = {} # year -> versions of its partitions when computed
+        self.years_data = {} # year -> (monthly, totals, weekdays)
+        self.tables = None
+        self.lock = threading.Lock()
+
+    def year_versions(self, year):
+        return [versions.get('summary', year)] + [versions.get_days(year, month) for month in range(1, 13)]
+
+    def compute_year(self, year):
+        df = read_store('SELECT month, heading, place, value FROM months WHERE topic = ? AND year = ?', ('summary', year))
+        df = df[df['heading'].isin(list(headings))]
+
+        monthly = np.full((len(self.topics), len(places), 13), np.nan)
+        monthly[
+            [self.topics.index(headings[heading]) for heading in df['heading']],
+            [places.index(place) for place in df['place']],
+            df['month'].to_numpy() - 1
+        ] = df['value'].to_numpy()
+
+        # average count of each weekday over the days of published months
+        day_weekdays, valid = calendar(year)
+        valid = valid & ~np.isnan(monthly[:, 2, :12]).all(axis=0)[:, None]
+        onehot = (day_weekdays[..., None] == np.arange(7)) & valid[..., None]
+        sums = np.einsum('tmd,mdw->tw', daily.year(year).astype(np.float64), onehot)
+        with np.errstate(invalid='ignore'):
+            weekday_means = sums / onehot.sum(axis=(0, 1))
+
+        return monthly[..., :12], monthly[..., 12], weekday_means
+
+    def combine(self, years):
+        monthly = np.full((len(self.topics), len(places), len(years), 12), np.nan)
+        totals = np.full((len(self.topics), len(places), len(years)), np.nan)
+        weekdays = np.full((len(self.topics), len(years), 7), np.nan)
+        for i, year in enumerate(years):
+            monthly[:, :, i], totals[:, :, i], weekdays[:, i] = self.years_data[year]
+
+        # the same year before, NaN for the first one and after a gap
+        previous = np.array([years.index(year - 1) if year - 1 in years else -1 for year in years], dtype=int)
+        has_previous = previous >= 0
+
+        year_delta = np.full(monthly.shape, np.nan)
+        year_delta[:, :, has_previous] = monthly[:, :, has_previous] - monthly[:, :, previous[has_previous]]
+        totals_delta = np.full(totals.shape, np.nan)
+        totals_delta[:, :, has_previous] = totals[:, :, has_previous] - totals[:, :, previous[has_previous]]
+
+        # month by month on the calendar from the first year to the last, months of missing years are NaN,
+        # so neither compares across a gap
+        positions = np.array(years, dtype=int) - (years[0] if years else 0)
+        on_calendar = np.full((len(self.topics), len(places), positions[-1] + 1 if years else 0, 12), np.nan)
+        on_calendar[:, :, positions] = monthly
+        flat = on_calendar.reshape(len(self.topics), len(places), -1)
+        month_delta = np.diff(flat, axis=2, prepend=np.nan).reshape(on_calendar.shape)[:, :, positions]
+
+        rolling = np.full(flat.shape, np.nan)
+        if flat.shape[2] >= rolling_months:
+            windows = np.lib.stride_tricks.sliding_window_view(flat, rolling_months, axis=2)
+            rolling[:, :, rolling_months - 1:] = windows.mean(axis=3)
+        rolling = rolling.reshape(on_calendar.shape)[:, :, positions]
+
+        return {
+            'years': list(years),
+            'monthly': monthly,
+            'totals': totals,
+            'month_delta': month_delta,
+            'year_delta': year_delta,
+            'totals_delta': totals_delta,
+            'rolling': rolling,
+            'weekdays': weekdays,
+        }
+
+    def get(self):
+        # the tables, computed again when a new data version was published
+        with self.lock:
+            if self.tables is not None and versions.version == self.version:
+                return self.tables
+
+            self.version = versions.version
+            years = load_years('summary')
+            for year in years:
+                year_versions = self.year_versions(year)
+                if self.built.get(year) != year_versions:
+                    self.years_data[year] = self.compute_year(year)
+                    self.built[year] = year_versions
+
+            self.tables = self.combine(years)
+            return self.tables
+
+
+rollups = Rollups()
@@ -0,0 +1,54 @@
+import time
+import logging
+import functools
+
+
+# STARTUP PROFILE
+# how long each startup phase of a web worker took, measured from the import of this module,
+# app.py marks its phases, the first data loads and layout build, which the first request pays for, are marked by first_call
+
+started = time.perf_counter()
+phases = [] # (name, seconds)
+first_calls = set() # names of the phases marked by first_call
+logged = False # phases marked later are logged one by one
+
+
+def mark(name, seconds=None):
+    # ends the phase running since the previous mark, or adds one which took the given seconds
+    if seconds is None:
+        seconds = time.perf_counter() - started - sum(seconds for _, seconds in phases)
+    phases.append((name, seconds))
+
+
+def first_call(name):
+    # marks and logs how long the first call of the decorated function took
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if name in first_calls:
+                return func(*args, **kwargs)
+            first_calls.add(name)
+
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            mark(name, time.perf_counter() - start)
+            if logged:
+                log(phases[-1:])
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def report():
+    lines = [f'{name:<10} {seconds * 1000:8.1f} ms' for name, seconds in phases]
+    lines.append(f'{"total":<10} {sum(seconds for _, seconds in phases) * 1000:8.1f} ms')
+    return '\n'.join(lines)
+
+
+def log(logged_phases=None):
+    # into the gunicorn log, with the pid of the worker, all phases marked until now by default
+    global logged
+    logged = True
+    logging.getLogger('gunicorn.error').info('startup: %s', ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in logged_phases or phases))
@@ -0,0 +1,47 @@
+import os
+import re
+import json
+import glob
+import timeit
+import argparse
+
+from bs4 import BeautifulSoup
+
+import app.parsing as datpar
+from tests.standin import pages_path
+
+
+# EXTRACTION BENCHMARK
+# compares reading totalChartData through the whole html tree with scanning the raw page
+
+def extract_soup(content):
+    # the former way, as it was in get_dataframes_days
+    soup = BeautifulSoup(content, 'html.parser')
+
+    text = str(soup.find_all('script')[3])
+    pattern = re.compile('var totalChartData = (.*?);')
+    match = pattern.search(text)
+    return json.loads(match.groups()[0].replace('\'', '"').replace('\\', ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=5, help='passes over all pages')
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pages_path, 'statistics', '*', '*', '*.html'))):
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+
+    for content in pages:
+        assert extract_soup(content) == datpar.parse_chart_data(content)
+
+    soup = timeit.timeit(lambda: [extract_soup(content) for content in pages], number=args.number)
+    scan = timeit.timeit(lambda: [datpar.parse_chart_data(content) for content in pages], number=args.number)
+
+    count = len(pages) * args.number
+    print(f'{len(pages)} pages, {args.number} passes')
+    print(f'BeautifulSoup: {soup / count * 1000:.3f} ms/page')
+    print(f'raw scan:      {scan / count * 1000:.3f} ms/page')
+    print(f'speedup:       {soup / scan:.0f}x')
@@ -0,0 +1,45 @@
+import time
+import argparse
+
+import requests
+
+import app.parsing as datpar
+from app.store import topics_days, topics_months
+from tests.standin import start_standin
+
+
+# FETCH BENCHMARK
+# compares the old one-by-one download with the concurrent one on recorded 2019 pages
+
+
+def fetch_serial(links):
+    return [requests.get(link).content for link in links]
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.1, help='simulated server response time in seconds')
+    parser.add_argument('--workers', type=int, default=datpar.max_workers)
+    parser.add_argument('--rate', type=float, default=0, help='requests per second, 0 for unlimited')
+    args = parser.parse_args()
+
+    server, url = start_standin(latency=args.latency)
+    links = [f'{url}/{topic}/2019/{month}' for topic in topics_days for month in range(1, 13)]
+    links += [f'{url}/{topic}/2019' for topic in topics_months]
+
+    serial = measure(fetch_serial, links)
+    concurrent = measure(datpar.fetch_pages, links, args.workers, args.rate)
+    assert datpar.fetch_pages(links, args.workers, args.rate) == fetch_serial(links)
+
+    print(f'{len(links)} pages, {args.latency * 1000:.0f} ms latency')
+    print(f'serial:     {serial:.2f} s')
+    print(f'concurrent: {concurrent:.2f} s ({args.workers} workers, {args.rate or "unlimited"} req/s)')
+    print(f'speedup:    {serial / concurrent:.1f}x')
+
+    server.shutdown()
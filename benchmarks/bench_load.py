@@ -0,0 +1,299 @@
+import os
+import sys
+import time
+import random
+import shutil
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+from contextlib import closing
+
+import numpy as np
+import requests
+
+import app.plane as datplane
+from app.store import store_path, topics_days
+from app.parsing import publish_version
+from tests.standin import start_standin
+
+
+# LOAD TEST
+# starts `gunicorn -c gunicorn.conf.py app.visualization.app:server` on a copy of the store, as the Procfile does
+# (with the data plane, the refresh worker scraping a local stand-in and the multiprocess metrics),
+# and replays dashboard sessions against it
+# from concurrent users: the page and layout, the callbacks of the first render, year clicks and downloads,
+# callbacks are posted to /_dash-update-component as the browser posts them, built from /_dash-dependencies
+# (month slider moves and the width breakpoint run in the browser, so slider sweeps send nothing)
+# reports throughput, latency percentiles, how many workers map the current data plane and memory of each worker
+# for every worker count and concurrency,
+# with --publish, new data versions are published meanwhile as the refresh worker does, so workers reload data
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+trends = ['totals', 'totals_delta', 'year_delta', 'rolling', 'month_delta', 'weekdays']
+
+callback_path = '/_dash-update-component'
+year_clicks = 2 # per session
+start_timeout = 60 # in seconds
+
+
+# SERVER
+def free_port():
+    with closing(socket.socket()) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_site():
+    # a folder to run the app in, with the code and the gunicorn config linked and the store copied,
+    # so neither the refresh worker nor published versions touch data/; the config writes the data plane there
+    site = tempfile.mkdtemp()
+    for name in ['app', 'gunicorn.conf.py']:
+        os.symlink(os.path.join(repo_path, name), os.path.join(site, name))
+    os.makedirs(os.path.join(site, 'data'))
+    shutil.copy(os.path.join(repo_path, store_path), os.path.join(site, store_path))
+    return site
+
+
+def start_server(site, workers, threads, refresh_url):
+    port = free_port()
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--chdir', site, '-w', str(workers), '--threads', str(threads),
+        '-b', f'127.0.0.1:{port}', 'app.visualization.app:server'
+    ]
+    # the refresh worker scrapes the recorded pages, never the library web
+    env = dict(os.environ, REFRESH_ARGS=f'--url {refresh_url}')
+    process = subprocess.Popen(command, cwd=site, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+
+    # ready when every worker answers, each one imports the app on its own
+    start = time.monotonic()
+    while time.monotonic() - start < start_timeout:
+        try:
+            if requests.get(url + '/_dash-layout', timeout=5).ok and len(worker_pids(process.pid)) == workers:
+                return process, url
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.2)
+
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def worker_pids(pid):
+    # web workers of the gunicorn master, without the refresh worker it runs next to them
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    stat = f.read()
+                with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                    command = f.read()
+            except OSError:
+                continue
+            if int(stat.rsplit(')', 1)[1].split()[1]) == pid and b'refresh.py' not in command:
+                pids.append(int(entry))
+    return sorted(pids)
+
+
+def maps_plane(pid, site):
+    # True when the worker maps the daily arrays from a data plane instead of holding its own,
+    # with --publish it may still map the previous one until it checks the versions again
+    with open(f'/proc/{pid}/maps') as f:
+        return os.path.join(os.path.realpath(site), datplane.plane_path) in f.read()
+
+
+def memory(pid):
+    # (rss, pss) in MB, pss splits shared pages (the mapped data plane, libraries) among the processes sharing them
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, value = line.split(':', 1)
+            if name in ['Rss', 'Pss']:
+                values[name] = int(value.split()[0]) / 1024
+    return values['Rss'], values['Pss']
+
+
+# SESSIONS
+class Dashboard:
+    # what a browser learns from the server before it posts any callback
+    def __init__(self, url):
+        self.url = url
+        self.dependencies = {dependency['output']: dependency for dependency in requests.get(url + '/_dash-dependencies').json()}
+        self.years = [option['value'] for option in find_component(requests.get(url + '/_dash-layout').json(), 'radio_year')['props']['options']]
+
+    def callback_body(self, output, values):
+        # values are keyed by 'id.property'
+        dependency = self.dependencies[output]
+
+        def props(items):
+            return [{'id': item['id'], 'property': item['property'], 'value': values.get(f'{item["id"]}.{item["property"]}')} for item in items]
+
+        outputs = [{'id': name.split('.')[0], 'property': name.split('.')[1]} for name in output.strip('.').split('...')]
+        return {
+            'output': output,
+            'outputs': outputs if output.startswith('..') else outputs[0],
+            'inputs': props(dependency['inputs']),
+            'state': props(dependency['state']),
+            'changedPropIds': [f'{dependency["inputs"][0]["id"]}.{dependency["inputs"][0]["property"]}'],
+        }
+
+
+def find_component(component, component_id):
+    if isinstance(component, list):
+        for child in component:
+            found = find_component(child, component_id)
+            if found:
+                return found
+    elif isinstance(component, dict):
+        props = component.get('props', {})
+        if props.get('id') == component_id:
+            return component
+        return find_component(props.get('children'), component_id)
+    return None
+
+
+class User:
+    # one browser replaying sessions, latencies are appended as (kind, seconds, ok)
+    def __init__(self, dashboard, seed):
+        self.dashboard = dashboard
+        self.session = requests.Session()
+        self.random = random.Random(seed)
+        self.latencies = []
+
+    def get(self, kind, path):
+        start = time.perf_counter()
+        response = self.session.get(self.dashboard.url + path)
+        self.latencies.append((kind, time.perf_counter() - start, response.ok))
+        return response
+
+    def callback(self, output, values):
+        start = time.perf_counter()
+        response = self.session.post(self.dashboard.url + callback_path, json=self.dashboard.callback_body(output, values))
+        self.latencies.append((output.strip('.').split('.')[0], time.perf_counter() - start, response.status_code in [200, 204]))
+        return response
+
+    def year(self, year, version):
+        values = {
+            'radio_year.value': year, 'data_version.data': version,
+            'radio_trend.value': self.random.choice(trends), 'radio_place.value': self.random.randrange(3),
+        }
+        self.callback('year_data.data', values)
+        self.callback('..table_summary.children...table_rating.children..', values)
+        self.callback('graph_trend.figure', values)
+
+    def run_session(self):
+        years = self.dashboard.years
+
+        # page, layout and the callbacks of the first render
+        self.get('page', '/')
+        self.get('layout', '/_dash-layout')
+        self.get('dependencies', '/_dash-dependencies')
+        version = self.callback('data_version.data', {'interval_version.n_intervals': 1}).json()['response']['data_version']['data']
+        self.year(years[-1], version)
+        dates = self.callback('..date_range.start_date...date_range.end_date..', {'radio_range.value': 90, 'data_version.data': version}).json()['response']['date_range']
+        self.callback('..date_range.min_date_allowed...date_range.max_date_allowed..', {'data_version.data': version})
+        self.callback('graph_range.figure', {'date_range.start_date': dates['start_date'], 'date_range.end_date': dates['end_date'], 'data_version.data': version})
+
+        # year clicks, month slider moves are clientside
+        for i in range(year_clicks):
+            self.year(self.random.choice(years), version)
+
+        # downloads
+        year = self.random.choice(years)
+        self.get('download', f'/download/summary/{year}.csv')
+        self.get('download', f'/download/days/{year}.csv')
+
+
+def run_users(dashboard, concurrency, duration):
+    # (latencies, sessions) of all users looping sessions for the duration
+    users = [User(dashboard, seed) for seed in range(concurrency)]
+    sessions = [0] * concurrency
+    end = time.monotonic() + duration
+
+    def loop(i):
+        while time.monotonic() < end:
+            try:
+                users[i].run_session()
+            except (requests.RequestException, ValueError, KeyError): # failed requests or responses without data
+                users[i].latencies.append(('session', 0, False))
+                continue
+            sessions[i] += 1
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return [latency for user in users for latency in user.latencies], sum(sessions)
+
+
+# DATA PUBLISHING
+def publish(site, interval, stop):
+    # bumps the version of the newest month of daily data and writes a new data plane, as the refresh worker does
+    path = os.path.join(site, store_path)
+    while not stop.wait(interval):
+        with closing(sqlite3.connect(path, timeout=30)) as con, con:
+            year, month = con.execute('SELECT year, month FROM days ORDER BY year DESC, month DESC LIMIT 1').fetchone()
+            publish_version(con, [(topic, year, month) for topic in topics_days])
+        datplane.write_plane(topics_days, path, os.path.join(site, datplane.plane_path))
+
+
+# REPORT
+def percentiles(latencies):
+    seconds = np.array([latency for kind, latency, ok in latencies]) if latencies else np.zeros(1)
+    return np.percentile(seconds, [50, 95, 99]) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='simultaneous users')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of each run')
+    parser.add_argument('--publish', type=float, help='publish a new data version every this many seconds')
+    parser.add_argument('--kinds', action='store_true', help='latencies of each request kind too')
+    args = parser.parse_args()
+
+    site = make_site()
+    standin, standin_url = start_standin()
+    print(f'{os.cpu_count()} cpus, users run in this process and share them with the server')
+    print(f'{"workers":>7} {"users":>5} {"sessions/s":>10} {"requests/s":>10} {"p50":>8} {"p95":>8} {"p99":>8} {"errors":>6} {"plane":>5}  worker rss/pss MB')
+
+    for workers in args.workers:
+        process, url = start_server(site, workers, args.threads, standin_url)
+        dashboard = Dashboard(url)
+        run_users(dashboard, workers, 1) # warm up every worker
+
+        for concurrency in args.concurrency:
+            stop = threading.Event()
+            if args.publish:
+                threading.Thread(target=publish, args=(site, args.publish, stop), daemon=True).start()
+
+            latencies, sessions = run_users(dashboard, concurrency, args.duration)
+            stop.set()
+
+            p50, p95, p99 = percentiles(latencies)
+            errors = sum(not ok for kind, latency, ok in latencies)
+            pids = worker_pids(process.pid)
+            workers_memory = ' '.join(f'{rss:.0f}/{pss:.0f}' for rss, pss in map(memory, pids))
+            mapped = f'{sum(maps_plane(pid, site) for pid in pids)}/{len(pids)}'
+            print(
+                f'{workers:>7} {concurrency:>5} {sessions / args.duration:>10.1f} {len(latencies) / args.duration:>10.1f} '
+                f'{p50:>6.1f}ms {p95:>6.1f}ms {p99:>6.1f}ms {errors:>6} {mapped:>5}  {workers_memory}'
+            )
+
+            if args.kinds:
+                for kind in sorted({kind for kind, latency, ok in latencies}):
+                    p50, p95, p99 = percentiles([latency for latency in latencies if latency[0] == kind])
+                    print(f'{"":>13} {kind:<22} {p50:>6.1f}ms {p95:>6.1f}ms {p99:>6.1f}ms')
+
+        process.terminate()
+        process.wait()
+
+    standin.shutdown()
+    shutil.rmtree(site, ignore_errors=True)
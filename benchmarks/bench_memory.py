@@ -0,0 +1,72 @@
+import sys
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path[:0] = ['app/visualization', 'app']
+import data
+import plane
+
+
+# MEMORY REPORT
+# bytes of what a web worker holds with the former dtypes (int64 frame values, a string index and header copy
+# in each frame, uint32 arrays) and with the compact ones: the monthly frames (indexes shared by frames
+# are counted once), the daily cube and series; the daily arrays are built by every worker without the data plane
+# and mapped from one shared copy with it
+
+def frames_bytes(frames):
+    indexes = {}
+    values = 0
+    for df in frames.values():
+        values += df.memory_usage(index=False).sum()
+        indexes[id(df.index)] = df.index.memory_usage(deep=True)
+        indexes[id(df.columns)] = df.columns.memory_usage(deep=True)
+    return values + sum(indexes.values())
+
+
+def former(frames):
+    # as the frames were loaded before, each one with its own int64 values and index objects
+    return {
+        key: pd.DataFrame(
+            df.to_numpy(np.int64),
+            index=pd.Index(list(df.index), dtype=object, name=df.index.name),
+            columns=pd.MultiIndex.from_tuples(list(df.columns), names=df.columns.names)
+        )
+        for key, df in frames.items()
+    }
+
+
+def former_bytes(arrays):
+    # counts as uint32, dates as they are
+    return sum(array.nbytes if array.dtype.kind == 'M' else array.size * np.dtype(np.uint32).itemsize for array in arrays)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4, help='web workers sharing the data plane')
+    args = parser.parse_args()
+
+    rows = []
+    for topic in ['summary', 'rating']:
+        frames = data.load_months(topic)
+        rows.append((f'months {topic}', frames_bytes(former(frames)), frames_bytes(frames)))
+
+    arrays = plane.build_arrays(data.topics_days)
+    rows.append(('daily cube', former_bytes([arrays['cube']]), arrays['cube'].nbytes))
+    rows.append(('daily series', former_bytes([arrays['dates'], arrays['series']]), arrays['dates'].nbytes + arrays['series'].nbytes))
+
+    print(f'{"per worker":<16} {"before":>10} {"after":>10} {"saved":>6}')
+    for name, before, after in rows:
+        print(f'{name:<16} {before:>10,} {after:>10,} {1 - after / before:>6.0%}')
+    before, after = sum(row[1] for row in rows), sum(row[2] for row in rows)
+    print(f'{"total":<16} {before:>10,} {after:>10,} {1 - after / before:>6.0%}')
+
+    # the daily arrays of all workers, built by each one or mapped from the plane (shared in the page cache)
+    with tempfile.TemporaryDirectory() as folder:
+        plane.write_plane(data.topics_days, folder=folder)
+        mapped = plane.Plane(folder).get(data.topics_days, plane.store_version())
+        built = sum(array.nbytes for array in arrays.values())
+        shared = sum(array.nbytes for array in mapped.values())
+        print(f'\ndaily arrays of {args.workers} workers: built {args.workers * built:,}, mapped plane {shared:,}')
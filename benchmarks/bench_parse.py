@@ -0,0 +1,59 @@
+import os
+import time
+import argparse
+import tempfile
+
+import app.parsing as datpar
+from app.store import topics_days
+from tests.standin import start_standin
+
+
+# PARSE BENCHMARK
+# compares parsing day pages after all of them are downloaded with parsing them while downloading,
+# and with replaying the pages from the archive; month pages are parsed in the process pool,
+# which is started by the first call and reused by the next ones
+
+
+def fetch_then_parse(links):
+    return [datpar.parse_page_days(content) for content in datpar.fetch_pages(links)]
+
+
+def measure(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated server response time in seconds')
+    parser.add_argument('--processes', type=int, default=datpar.parse_processes)
+    args = parser.parse_args()
+
+    datpar.parse_processes = args.processes
+
+    server, url = start_standin(latency=args.latency)
+    links = [f'{url}/{topic}/2019/{month}' for topic in topics_days for month in range(1, 13)]
+
+    archive = datpar.PageArchive(os.path.join(tempfile.mkdtemp(), 'archive.sqlite'))
+
+    serial = measure(fetch_then_parse, links)
+    pipeline = measure(datpar.get_dataframes, links, datpar.parse_page_days, archive=archive)
+    replay = measure(datpar.get_dataframes, links, datpar.parse_page_days, archive=archive, replay=True)
+
+    month_links = [f'{url}/{topic}/{year}' for topic in ['rating', 'summary'] for year in [2015, 2019, 2020]] * 3
+    datpar.get_dataframes(month_links, datpar.parse_page_months, archive=archive)
+    months_inline = measure(datpar.get_dataframes, month_links, datpar.parse_page_months, archive=archive, replay=True)
+    months_started = measure(datpar.get_dataframes, month_links, datpar.parse_page_months, archive=archive, replay=True, processes=True)
+    months_reused = measure(datpar.get_dataframes, month_links, datpar.parse_page_months, archive=archive, replay=True, processes=True)
+
+    print(f'{len(links)} day pages, {args.latency * 1000:.0f} ms latency')
+    print(f'fetch, then parse:    {serial:.2f} s')
+    print(f'pipeline:             {pipeline:.2f} s')
+    print(f'replay from archive:  {replay:.3f} s')
+    print(f'{len(month_links)} month pages replayed, {args.processes} processes')
+    print(f'in this process:      {months_inline:.3f} s')
+    print(f'pool started:         {months_started:.3f} s')
+    print(f'pool reused:          {months_reused:.3f} s')
+
+    server.shutdown()
@@ -0,0 +1,63 @@
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+# STARTUP BENCHMARK
+# boots a web worker in fresh processes as gunicorn does and times its phases (see app/visualization/startup.py),
+# together with the first data loads and layout build which the first request pays for and the worker marks itself
+
+scraper_modules = ['requests', 'bs4', 'lxml', 'app.parsing']
+
+
+def boot(scraper):
+    from app.visualization import startup
+    if scraper:
+        # as web workers did before, when data.py imported the scraper
+        import app.parsing
+        startup.mark('scraper')
+
+    import app.visualization.app as webapp
+    from app.visualization import data
+
+    data.reload_changed_data()
+    data.daily.get_counts()
+    data.series.get()
+    data.summary[data.load_years('summary')[-1]]
+    webapp.app.layout()
+
+    return {'phases': startup.phases, 'scraper': [module for module in scraper_modules if module in sys.modules]}
+
+
+def run(runs, scraper):
+    results = []
+    for i in range(runs):
+        command = [sys.executable, '-m', 'benchmarks.bench_startup', '--boot'] + (['--scraper'] if scraper else [])
+        results.append(json.loads(subprocess.run(command, capture_output=True, text=True, check=True).stdout))
+    return results
+
+
+def print_median(title, results):
+    print(title)
+    phases = [name for name, seconds in results[0]['phases']]
+    for i, name in enumerate(phases):
+        print(f'  {name:<10} {statistics.median(result["phases"][i][1] for result in results) * 1000:8.1f} ms')
+    print(f'  {"total":<10} {statistics.median(sum(seconds for _, seconds in result["phases"]) for result in results) * 1000:8.1f} ms')
+    print(f'  scraper modules loaded: {", ".join(results[0]["scraper"]) or "none"}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes, medians are reported')
+    parser.add_argument('--boot', action='store_true', help='boot once and print the phases as json')
+    parser.add_argument('--scraper', action='store_true', help='import the scraper before the app')
+    args = parser.parse_args()
+
+    if args.boot:
+        print(json.dumps(boot(args.scraper)))
+        sys.exit()
+
+    print_median('web worker', run(args.runs, False))
+    print_median('web worker with the scraper imported', run(args.runs, True))
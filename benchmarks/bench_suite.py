@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+# the app writes its cache into a temporary file, so the benchmark neither reads old cache entries nor leaves any
+folder = tempfile.mkdtemp()
+
+import app.visualization.cache as datcache
+datcache.shared_cache.path = os.path.join(folder, 'cache.sqlite')
+
+import app.parsing as datpar
+import app.plane as datplane
+import app.visualization.data as datload
+import app.visualization.export as datexport
+from app.store import topics_days
+from app.visualization.app import app
+from tests.standin import start_standin
+
+
+# BENCHMARK SUITE
+# times the data loading, every callback (server ones through the Flask test client, clientside ones in node)
+# across all years, months and both width breakpoints, parsing of the recorded pages from tests/pages
+# and the store and CSV writing paths, all offline
+# results are compared with a saved baseline, a case slower than the baseline by more than the threshold fails the run:
+#     python -m benchmarks.bench_suite --save   # on the code to compare with
+#     python -m benchmarks.bench_suite          # after the change
+
+baseline_path = os.path.join('benchmarks', 'baseline.json')
+threshold = 0.25 # relative slowdown which fails the run
+min_delta = 0.002 # in seconds, smaller differences are noise
+
+callback_path = '/_dash-update-component'
+
+widths = [800, 1200] # under and over the width breakpoint
+trends = ['totals', 'totals_delta', 'year_delta', 'rolling', 'month_delta', 'weekdays']
+
+
+def measure(func, repeat):
+    # seconds of each run after one warm up run
+    func()
+    runs = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+# DATA LOADING
+def cold_import(repeat):
+    # in fresh processes, as a web worker imports it
+    code = 'import time; start = time.perf_counter(); import app.visualization.data; print(time.perf_counter() - start)'
+    return [float(subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout) for i in range(repeat + 1)][1:]
+
+
+def load_months():
+    for topic in ['summary', 'rating']:
+        datload.load_months(topic)
+
+
+def build_daily_arrays():
+    datplane.build_arrays(topics_days)
+
+
+# SERVER CALLBACKS
+client = app.server.test_client()
+
+
+def post(output, values):
+    # one callback request as the browser sends it, values are keyed by 'id.property'
+    spec = app.callback_map[output]
+
+    def props(items):
+        return [{'id': item['id'], 'property': item['property'], 'value': values[f'{item["id"]}.{item["property"]}']} for item in items]
+
+    outputs = [
+        {'id': name.split('.')[0], 'property': name.split('.')[1]}
+        for name in output.strip('.').split('...')
+    ]
+    response = client.post(callback_path, json={
+        'output': output,
+        'outputs': outputs if output.startswith('..') else outputs[0],
+        'inputs': props(spec['inputs']),
+        'state': props(spec['state']),
+        'changedPropIds': [f'{spec["inputs"][0]["id"]}.{spec["inputs"][0]["property"]}'],
+    })
+    assert response.status_code in [200, 204], (output, response.status_code)
+
+
+def callback_sweeps():
+    # every server callback over all its input combinations
+    years = list(datload.summary)
+    version = datload.versions.version
+    start, end = [str(date) for date in datload.series.last(90)[0][[0, -1]]]
+
+    return {
+        'year_data': [('year_data.data', {'radio_year.value': year, 'data_version.data': version}) for year in years],
+        'tables': [('..table_summary.children...table_rating.children..', {'radio_year.value': year, 'data_version.data': version}) for year in years],
+        'trend': [
+            ('graph_trend.figure', {'radio_trend.value': trend, 'radio_place.value': place, 'radio_year.value': year, 'data_version.data': version})
+            for trend in trends for place in range(3) for year in years
+        ],
+        'date_range': [
+            ('..date_range.start_date...date_range.end_date..', {'radio_range.value': days, 'data_version.data': version})
+            for days in [30, 90, 365]
+        ] + [('..date_range.min_date_allowed...date_range.max_date_allowed..', {'data_version.data': version})],
+        'range': [('graph_range.figure', {'date_range.start_date': start, 'date_range.end_date': end, 'data_version.data': version})],
+    }
+
+
+def clear_cache():
+    datcache.shared_cache.connect().execute('DELETE FROM cache')
+
+
+def run_sweep(requests, cold):
+    def run():
+        for output, values in requests:
+            if cold: # built again, as after a data update
+                clear_cache()
+            post(output, values)
+    return run
+
+
+# CLIENTSIDE CALLBACKS
+def clientside_runs(repeat):
+    # {callback: [seconds]}, each run calls the callback for every year, month and width, timed in node
+    if not shutil.which('node'):
+        print('node not found, clientside callbacks are skipped')
+        return {}
+
+    payloads = [datload.year_payload(year) for year in datload.summary]
+    clientside = {callback['output']: callback['clientside_function'] for callback in app._callback_list if 'clientside_function' in callback}
+    functions = {
+        name: clientside[output]
+        for name, output in [
+            ('slider', '..slider_month.marks...slider_month.value...slider_year.children..'),
+            ('daily', 'graph_summary_daily.figure'),
+            ('monthly', 'graph_summary_monthly.figure'),
+            ('rating', '..rating_contrib.children...rating_stars.children..'),
+        ]
+    }
+
+    script = 'var window = {dash_clientside: {no_update: null}};\n' + '\n'.join(app._inline_scripts) + f'''
+    var payloads = {json.dumps(payloads)}, widths = {json.dumps(widths)}, repeat = {repeat}
+    var functions = {{{', '.join(f'{json.dumps(name)}: window.dash_clientside[{json.dumps(function["namespace"])}][{json.dumps(function["function_name"])}]' for name, function in functions.items())}}}
+    var calls = {{
+        'slider': function(f, data, month, width) {{ return f(data, width, month, String(data.year)) }},
+        'daily': function(f, data, month, width) {{ return f(data, month, width) }},
+        'monthly': function(f, data, month, width) {{ return f(data, month, width) }},
+        'rating': function(f, data, month, width) {{ return f(data, month) }}
+    }}
+    var results = {{}}
+    Object.keys(functions).forEach(function(name) {{
+        results[name] = []
+        for (var run = 0; run <= repeat; run++) {{
+            var start = process.hrtime.bigint()
+            payloads.forEach(function(data) {{
+                data.months.forEach(function(month) {{
+                    widths.forEach(function(width) {{ calls[name](functions[name], data, month, width) }})
+                }})
+            }})
+            if (run > 0) {{ results[name].push(Number(process.hrtime.bigint() - start) / 1e9) }}
+        }}
+    }})
+    console.log(JSON.stringify(results))
+    '''
+    path = os.path.join(folder, 'clientside.js')
+    with open(path, 'w') as f:
+        f.write(script)
+
+    runs = json.loads(subprocess.run(['node', path], capture_output=True, text=True, check=True).stdout)
+    return {f'clientside {name}': seconds for name, seconds in runs.items()}
+
+
+# PARSING AND SAVING
+def parse_cases(url):
+    # pages are parsed from an archive filled once, downloads would only measure the rate limit (see bench_fetch)
+    years_months = [2015, 2019, 2020]
+    months = list(range(1, 13))
+    store = os.path.join(folder, 'store.sqlite')
+    archive = datpar.PageArchive(os.path.join(folder, 'archive.sqlite'))
+
+    dataframes_months = datpar.get_dataframes_months(url, ['rating', 'summary'], years_months, archive=archive)
+    dataframes_days = datpar.get_dataframes_days(url, topics_days, [2019], months, archive=archive)
+
+    return {
+        'parse months': lambda: datpar.get_dataframes_months(url, ['rating', 'summary'], years_months, archive=archive, replay=True),
+        'parse days': lambda: datpar.get_dataframes_days(url, topics_days, [2019], months, archive=archive, replay=True),
+        'save months': lambda: datpar.save_months_to_store(dataframes_months, ['rating', 'summary'], years_months, path=store),
+        'save days': lambda: datpar.save_days_to_store(dataframes_days, topics_days, [2019], months, path=store),
+        'export summary csv': lambda: ''.join(datexport.export_summary(list(datload.summary), 'csv')),
+        'export days csv': lambda: ''.join(datexport.export_days(list(datload.summary), 'csv')),
+    }
+
+
+# RUN
+def run_suite(repeat, only=None):
+    # {case: seconds of the fastest run}, the least disturbed by other load on the machine
+    datload.reload_changed_data()
+    # tables are warmed in a thread at import, it must not run along the measurements
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join()
+
+    server, url = start_standin()
+
+    cases = {
+        'import data.py': lambda: cold_import(repeat),
+        'load months': lambda: measure(load_months, repeat),
+        'build daily arrays': lambda: measure(build_daily_arrays, repeat),
+    }
+    for name, requests in callback_sweeps().items():
+        cases[f'callback {name} cold'] = lambda requests=requests: measure(run_sweep(requests, True), repeat)
+        cases[f'callback {name} warm'] = lambda requests=requests: measure(run_sweep(requests, False), repeat)
+    for name, func in parse_cases(url).items():
+        cases[name] = lambda func=func: measure(func, repeat)
+
+    results = {}
+    for name, run in cases.items():
+        if not only or only in name:
+            results[name] = min(run())
+
+    for name, runs in clientside_runs(repeat).items():
+        if not only or only in name:
+            results[name] = min(runs)
+
+    server.shutdown()
+    return results
+
+
+def compare(results, baseline, threshold=threshold):
+    # names of the cases slower than the baseline by more than the threshold
+    print(f'{"case":<32} {"baseline":>10} {"now":>10} {"change":>8}')
+    regressions = []
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f'{name:<32} {"-":>10} {seconds * 1000:8.1f}ms')
+            continue
+
+        change = seconds / before - 1
+        regressed = change > threshold and seconds - before > min_delta
+        print(f'{name:<32} {before * 1000:8.1f}ms {seconds * 1000:8.1f}ms {change:+7.0%}' + (' REGRESSION' if regressed else ''))
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each case, the fastest ones are compared')
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--threshold', type=float, default=threshold, help='e.g. 0.25 fails cases more than 25 %% slower')
+    parser.add_argument('--only', help='run only the cases with this text in their name')
+    args = parser.parse_args()
+
+    results = run_suite(args.repeat, args.only)
+    shutil.rmtree(folder, ignore_errors=True)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+        compare(results, {})
+        print(f'baseline saved to {args.baseline}')
+        sys.exit()
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+        print(f'no baseline in {args.baseline}, save one with --save')
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regressions over {args.threshold:.0%}: {", ".join(regressions)}')
+        sys.exit(1)
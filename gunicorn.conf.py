@@ -0,0 +1,79 @@
+import os
+import sys
+import shutil
+import threading
+import subprocess
+
+from app.metrics import multiprocess_path
+
+# METRICS
+# set before anything imports prometheus_client, the workers and the refresh worker inherit it (see app/metrics.py)
+os.environ.setdefault('prometheus_multiproc_dir', os.path.abspath(multiprocess_path))
+
+from app.plane import ensure_plane
+from app.store import remove_database, topics_days
+
+
+# GUNICORN CONFIG
+# read by `gunicorn -c gunicorn.conf.py` (see Procfile)
+
+# REFRESH WORKER
+# started by the gunicorn master next to the web workers, so it writes the store and the data plane
+# on the filesystem they read (each Heroku dyno has its own one), exactly one runs per server
+# REFRESH_ARGS are added to its arguments, e.g. '--url http://127.0.0.1:8000/statistics' for a local stand-in (tests/standin.py)
+refresh_command = [sys.executable, os.path.join('app', 'refresh.py')] + os.environ.get('REFRESH_ARGS', '').split()
+refresh_restart_delay = 30 # in seconds, a refresh worker which keeps dying is not restarted in a tight loop
+refresher = None
+refresher_lock = threading.Lock()
+stopping = threading.Event()
+
+# SHARED CACHE
+# its keys name only the callbacks and data versions, so responses cached by older code or for a rebuilt store
+# are not served after a restart or deploy
+cache_path = os.path.join('data', 'cache.sqlite') # as in app/visualization/cache.py, which imports dash
+
+
+def on_starting(server):
+    # samples of a previous server are not added to this one
+    shutil.rmtree(os.environ['prometheus_multiproc_dir'], ignore_errors=True)
+    os.makedirs(os.environ['prometheus_multiproc_dir'])
+    remove_database(cache_path)
+
+
+def when_ready(server):
+    # the data plane is written before the workers start, so none of them builds the daily arrays
+    ensure_plane(topics_days)
+
+    threading.Thread(target=supervise_refresher, args=(server,), daemon=True).start()
+
+
+def supervise_refresher(server):
+    # runs in a thread of the master, a dead refresh worker is logged and started again until the server stops
+    global refresher
+    while True:
+        with refresher_lock:
+            if stopping.is_set():
+                return
+            refresher = subprocess.Popen(refresh_command)
+        server.log.info('refresh worker started (pid %d)', refresher.pid)
+
+        code = refresher.wait()
+        if stopping.is_set():
+            return
+        server.log.error('refresh worker exited with code %d, data are not refreshed, restarting it in %d s', code, refresh_restart_delay)
+        if stopping.wait(refresh_restart_delay):
+            return
+
+
+def on_exit(server):
+    with refresher_lock:
+        stopping.set()
+    if refresher and refresher.poll() is None:
+        refresher.terminate()
+        refresher.wait()
+
+
+def child_exit(server, worker):
+    # gauges of a stopped worker are no longer served
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,76 @@
+import os
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+
+# LOCAL STAND-IN FOR THE LIBRARY WEB
+# serves recorded pages, /statistics/search/2019/5 is read from <root>/statistics/search/2019/5.html
+# or replays the latest archived version of <origin>/statistics/search/2019/5 (see PageArchive in app/parsing.py)
+
+pages_path = os.path.join(os.path.dirname(__file__), 'pages')
+origin = 'https://susice.tritius.cz'
+
+
+class StandinHandler(SimpleHTTPRequestHandler):
+    latency = 0 # in seconds, simulates the round trip to the real server
+    archive = None
+    origin = origin
+
+    def translate_path(self, path):
+        return super().translate_path(path.rstrip('/')) + '.html'
+
+    def end_headers(self):
+        # recorded pages are always fresh
+        self.send_header('Cache-Control', 'no-cache')
+        super().end_headers()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if not self.archive:
+            super().do_GET()
+            return
+
+        content = self.archive.get(self.origin + self.path.rstrip('/'))
+        if content is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_standin(root=pages_path, latency=0, port=0, archive=None, origin=origin):
+    # runs the server in a background thread, returns it together with its base url
+    handler = type('Handler', (StandinHandler,), {'latency': latency, 'archive': archive, 'origin': origin})
+    server = ThreadingHTTPServer(('127.0.0.1', port), lambda *args: handler(*args, directory=root))
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server, f'http://127.0.0.1:{server.server_address[1]}/statistics'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='in seconds')
+    parser.add_argument('--archive', help='serve pages from this archive, e.g. data/archive.sqlite')
+    args = parser.parse_args()
+
+    archive = None
+    if args.archive:
+        from app.parsing import PageArchive
+        archive = PageArchive(args.archive)
+
+    server, url = start_standin(latency=args.latency, port=args.port, archive=archive)
+    print(f'Serving recorded pages on {url}')
+    threading.Event().wait()
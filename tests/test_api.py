@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import subprocess
+
+import app.visualization.data as datload
+import app.visualization.api as datapi
+import app.visualization.monitoring as datmon
+from app.visualization.app import server
+
+
+client = server.test_client()
+
+
+def get_counts(query):
+    response = client.get('/api/v1/counts', query_string=query)
+    return response, json.loads(response.get_data())
+
+
+### API TESTING
+
+def test_api_days():
+    response, result = get_counts({'topic': 'search,access', 'start': '2020-02-27', 'end': '2020-03'})
+    assert response.status_code == 200 and result['columns'] == ['period', 'search', 'access']
+
+    # the end month is included whole
+    dates, counts = datload.series.range('2020-02-27', '2020-03-31')
+    assert [row[0] for row in result['rows']] == dates.astype(str).tolist()
+    assert [row[1:] for row in result['rows']] == counts[[2, 0]].T.tolist()
+
+    # longer than one streamed chunk
+    response, result = get_counts({'start': '2016', 'end': '2019'})
+    assert len(result['rows']) == 4 * 365 + 1 > datapi.chunk_rows
+    assert result['query']['start'] == '2016-01-01' and result['query']['end'] == '2019-12-31'
+
+
+def test_api_months_years():
+    response, result = get_counts({'topic': 'login', 'start': '2019-11-15', 'end': '2020-01-02', 'granularity': 'month', 'place': 'remote'})
+    summary = datload.summary
+    assert result['rows'] == [
+        ['2019-11', summary[2019].loc['Listopad', ('Statistiky přihlášování', 'Mimo knihovnu')]],
+        ['2019-12', summary[2019].loc['Prosinec', ('Statistiky přihlášování', 'Mimo knihovnu')]],
+        ['2020-01', summary[2020].loc['Leden', ('Statistiky přihlášování', 'Mimo knihovnu')]],
+    ]
+
+    # the library web has no data before november 2015
+    response, result = get_counts({'topic': 'access', 'start': '2015', 'end': '2015', 'granularity': 'month'})
+    assert [row[1] for row in result['rows']][:10] == [None] * 10 and result['rows'][10][1] is not None
+
+    response, result = get_counts({'granularity': 'year', 'place': 'library'})
+    assert [row[0] for row in result['rows']] == [f'{year}' for year in summary]
+    assert result['rows'][-1][1] == summary[2020].loc['Souhrnně celkem', ('Přístupy', 'V knihovně')]
+
+
+def test_api_errors_etag():
+    for query in [{'topic': 'rating'}, {'granularity': 'week'}, {'place': 'remote'}, {'start': '2019-13'}, {'start': '2020', 'end': '2019'}]:
+        response, result = get_counts(query)
+        assert response.status_code == 400 and 'error' in result
+
+    response = client.get('/api/v1/counts?granularity=year')
+    assert client.get('/api/v1/counts?granularity=year', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/api/v1/counts?granularity=month', headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+
+def test_api_batch():
+    queries = [{'topic': ['login'], 'granularity': 'year', 'start': '2019'}, {'place': 'elsewhere'}, 5]
+    results = json.loads(client.post('/api/v1/batch', json={'queries': queries}).get_data())['results']
+
+    assert results[0]['rows'] == get_counts({'topic': 'login', 'granularity': 'year', 'start': '2019'})[1]['rows']
+    assert 'error' in results[1] and 'error' in results[2]
+
+    # values of the wrong type are errors of their query, not of the whole response
+    queries = [{'place': ['x']}, {'granularity': {'day': 1}}, {'start': 20200101}, {'end': ['2020']}]
+    results = json.loads(client.post('/api/v1/batch', json={'queries': queries}).get_data())['results']
+    assert results[0]['error'].startswith('place must be') and results[1]['error'].startswith('granularity must be')
+    assert results[2]['error'] == results[3]['error'] == 'start and end must be dates as YYYY, YYYY-MM or YYYY-MM-DD'
+
+    assert client.post('/api/v1/batch', json={'queries': []}).status_code == 400
+    assert client.post('/api/v1/batch', json={'queries': [{}] * (datapi.max_batch + 1)}).status_code == 400
+
+
+### METRICS ROUTE TESTING
+
+def test_metrics_route():
+    # a callback request is timed and served in the prometheus text format
+    client.post('/_dash-update-component', json={'output': 'unknown.children', 'inputs': [], 'changedPropIds': []})
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    assert 'dash_callback_seconds_count{callback="unknown.children"}' in text
+
+
+def test_metrics_route_multiprocess(tmp_path, monkeypatch):
+    # samples of other processes sharing prometheus_multiproc_dir, as the refresh worker under gunicorn, are added up
+    monkeypatch.setenv('prometheus_multiproc_dir', str(tmp_path))
+    script = "import app.refresh as datref; datref.runs_total.labels('ok').inc(); datref.last_success_time.set(float(sys.argv[1]))"
+    for success_time in ['100', '200']:
+        subprocess.run([sys.executable, '-c', f'import sys; {script}', success_time], env=os.environ, check=True)
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'refresh_runs_total{result="ok"} 2.0' in text and 'refresh_last_success_time 200.0' in text
+
+
+def test_profile_flag(tmp_path, monkeypatch):
+    monkeypatch.setattr(datmon, 'profile_flag', os.path.join(tmp_path, 'profile'))
+    monkeypatch.setattr(datmon, 'profiles_path', os.path.join(tmp_path, 'profiles'))
+    monkeypatch.setattr(datmon, 'profile_every', 1)
+    def callback():
+        client.post('/_dash-update-component', json={'output': 'profiled.children', 'inputs': [], 'changedPropIds': []})
+
+    # profiled only while the flag file exists
+    callback()
+    assert not os.path.exists(datmon.profiles_path)
+    open(datmon.profile_flag, 'w').close()
+    callback(), callback()
+    profiles = os.listdir(datmon.profiles_path)
+    assert len(profiles) == 2 and all(profile.startswith('profiled_children-') for profile in profiles)
+
+    os.remove(datmon.profile_flag)
+    callback()
+    assert len(os.listdir(datmon.profiles_path)) == 2
+    assert 'dash_callback_profiles_total{callback="profiled.children"} 2.0' in client.get('/metrics').get_data(as_text=True)
+
+
+### DOWNLOAD ROUTE TESTING
+
+def test_download():
+    response = client.get('/download/summary/2019.csv')
+    lines = response.get_data(as_text=True).splitlines()
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    assert lines[2].startswith('Leden,') and len(lines) == 2 + 13
+
+    response = client.get('/download/days/2019.html')
+    assert response.status_code == 200 and response.mimetype == 'text/html'
+    assert response.get_data(as_text=True).startswith('<table') and '<th>Vyhledávání</th>' in response.get_data(as_text=True)
+
+    # all years, one header and a heading for each year
+    lines = client.get('/download/days/all.csv').get_data(as_text=True).splitlines()
+    assert lines[0] == 'Rok,Měsíc,Den,Přístupy,Přihlášení,Vyhledávání' and lines.count(lines[0]) == 1
+    assert {line.split(',')[0] for line in lines[1:]} == {str(year) for year in datload.summary}
+    assert client.get('/download/summary/all.html').get_data(as_text=True).count('<h2>') == len(datload.summary)
+
+
+def test_download_etag():
+    response = client.get('/download/summary/2019.csv')
+    etag = response.headers['ETag']
+    assert etag.startswith('"summary-2019-') and response.cache_control.max_age == 5 * 60
+
+    cached = client.get('/download/summary/2019.csv', headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.get_data() == b''
+    assert client.get('/download/summary/2019.csv', headers={'If-None-Match': '"other"'}).status_code == 200
+    assert client.get('/download/days/2019.csv').headers['ETag'] != etag
+
+
+def test_download_not_found():
+    for path in ['/download/rating/2019.csv', '/download/summary/2019.xlsx', '/download/summary/2014.csv',
+                 '/download/days/last.csv']:
+        assert client.get(path).status_code == 404
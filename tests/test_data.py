@@ -0,0 +1,338 @@
+import pytest
+
+import os
+import json
+import numpy as np
+import dash
+from dash.dependencies import Input, Output
+import pandas as pd
+
+import app.parsing as datpar
+import app.visualization.data as datload
+import app.visualization.rollups as datroll
+import app.plane as datplane
+from app.visualization.cache import SharedCache, memoize
+
+
+### LAZY DATA LOADING TESTING
+
+def test_lazy_frames():
+    loads = []
+    def load(key):
+        loads.append(key)
+        if key > 3:
+            raise KeyError(key)
+        return key * 10
+
+    frames = datload.LazyFrames(load, lambda: [1, 2, 3], size=2)
+
+    assert frames[1] == 10 and frames[2] == 20 and frames[1] == 10
+    assert loads == [1, 2]
+    # 2 is the least recently used one
+    assert frames[3] == 30 and frames[1] == 10 and frames[2] == 20
+    assert loads == [1, 2, 3, 2]
+
+    frames.invalidate(2)
+    assert frames[2] == 20
+    assert loads == [1, 2, 3, 2, 2]
+
+    with pytest.raises(KeyError):
+        frames[4]
+    assert list(frames) == [1, 2, 3] and len(frames) == 3
+
+
+def test_lazy_store():
+    assert datload.summary[2019].loc['Květen', 'Vyhledávání']['Vše'] == 2353
+    assert 2015 in datload.rating and 2014 not in datload.rating
+    assert len(datload.summary) == 6
+
+
+def test_compact_frames():
+    frames = datload.load_months('summary')
+    assert (frames[2019].dtypes == datload.month_dtype).all()
+    assert frames[2019].index.dtype == datload.month_labels
+    # the same header and months are one object
+    assert frames[2019].columns is frames[2018].columns and frames[2019].index is frames[2018].index
+    assert frames[2015].index is not frames[2019].index
+
+
+### DAILY CUBE TESTING
+
+def test_daily_cube():
+    cube = datload.DailyCube(['access', 'login', 'search'])
+
+    access, login, search = cube.year(2019)[:, 4]
+    assert access[0] == 21 and access[30] == 31
+    assert login.shape == (31,)
+    # february 2020 is padded
+    assert cube.year(2020)[1, 1, 18] == 30 and list(cube.year(2020)[1, 1, 29:]) == [0, 0]
+    assert cube.year(2016)[2, 6, 11] == 97 + 31 + 5
+    assert not cube.year(2014).any()
+
+    access, login, search = cube.month(2019, 5)
+    assert access[0] == 21 and (cube.month(2020, 2) == cube.year(2020)[:, 1]).all() and not cube.month(2014, 1).any()
+
+    span = cube.span((2019, 11), (2020, 2))
+    assert span.shape == (3, 4, 31)
+    assert (span[:, 0] == cube.month(2019, 11)).all() and (span[:, 3] == cube.month(2020, 2)).all()
+    # months are aligned on the calendar, years the store does not have are zeroes
+    span = cube.span((2014, 12), (2015, 11))
+    assert not span[:, :11].any() and (span[:, 11] == cube.month(2015, 11)).all()
+
+    years, totals = cube.monthly_totals()
+    assert totals[0, years.index(2019), 4] == cube.month(2019, 5)[0].sum()
+
+    # the same data version is not built again
+    before = cube.counts
+    cube.reload()
+    assert cube.counts is before
+
+
+### DATA PLANE TESTING
+
+def test_plane(tmp_path, monkeypatch):
+    topics = ['access', 'login', 'search']
+    folder = os.path.join(tmp_path, 'plane')
+    version = datplane.store_version()
+    plane = datplane.Plane(folder)
+    assert plane.get(topics, version) is None
+
+    name = datplane.write_plane(topics, folder=folder)
+    arrays = plane.get(topics, version)
+    assert isinstance(arrays['cube'], np.memmap) and not arrays['cube'].flags.writeable
+    for array_name, array in datplane.build_arrays(topics).items():
+        assert (arrays[array_name] == array).all()
+
+    # mapped once, other data are not taken from the plane
+    assert plane.get(topics, version) is arrays
+    assert plane.get(topics, version + 1) is None and plane.get(topics[:2], version) is None
+
+    # a new plane is swapped in, only the newest ones are kept
+    for i in range(datplane.keep_planes):
+        datplane.write_plane(topics, folder=folder)
+    assert plane.get(topics, version) is not arrays
+    assert name not in os.listdir(folder) and len(os.listdir(folder)) == datplane.keep_planes + 1
+
+    # written only when the current one is not the newest
+    arrays = plane.get(topics, version)
+    assert datplane.ensure_plane(topics, folder=folder) is None and plane.get(topics, version) is arrays
+    assert datplane.ensure_plane(topics[:2], folder=folder) is not None and plane.get(topics, version) is None
+
+    # workers map the daily data from the plane
+    datplane.write_plane(topics, folder=folder)
+    monkeypatch.setattr(datload, 'plane', plane)
+    cube = datload.DailyCube(topics)
+    assert cube.get_counts()[1] is plane.arrays['cube']
+    assert cube.year(2019)[0, 4, 0] == 21
+
+
+def test_daily_arrays_built_once(tmp_path, monkeypatch):
+    # without a plane, the cube and the series share arrays built once per data version
+    monkeypatch.setattr(datload, 'plane', datplane.Plane(os.path.join(tmp_path, 'plane')))
+    monkeypatch.setattr(datload, 'built_arrays', {})
+    topics = ['access', 'login', 'search']
+
+    arrays = datload.load_daily_arrays(topics)
+    assert datload.load_daily_arrays(topics) is arrays
+    assert datload.DailyCube(topics).get_counts()[1] is arrays['cube'] and datload.DailySeries(topics).get()[1] is arrays['series']
+
+    monkeypatch.setattr(datload, 'store_version', lambda path: datplane.store_version(path) + 1)
+    assert datload.load_daily_arrays(topics) is not arrays
+
+
+
+def test_plane_written_after_version(tmp_path, monkeypatch):
+    # the refresh worker publishes a new data version before it writes its plane
+    topics = ['access', 'login', 'search']
+    version = datplane.store_version()
+    plane = datplane.Plane(os.path.join(tmp_path, 'plane'))
+    datplane.write_plane(topics, folder=plane.folder)
+    for name, value in [('plane', plane), ('built_arrays', {}), ('versions', datload.DataVersions(0)),
+                        ('daily', datload.DailyCube(topics)), ('series', datload.DailySeries(topics))]:
+        monkeypatch.setattr(datload, name, value)
+    datload.reload_changed_data()
+    assert isinstance(datload.daily.get_counts()[1], np.memmap) and isinstance(datload.series.get()[1], np.memmap)
+
+    # a worker reloads in between and builds the arrays
+    monkeypatch.setattr(datload, 'store_version', lambda path: version + 1)
+    datload.daily.reload(), datload.series.reload()
+    assert not isinstance(datload.daily.get_counts()[1], np.memmap)
+    datload.reload_changed_data()
+    assert not isinstance(datload.daily.get_counts()[1], np.memmap)
+
+    # and maps them once the plane is written
+    monkeypatch.setattr(datplane, 'store_version', lambda path: version + 1)
+    datplane.write_plane(topics, folder=plane.folder)
+    datload.reload_changed_data()
+    assert datload.daily.get_counts()[1] is plane.arrays['cube'] and datload.series.get()[1] is plane.arrays['series']
+    assert datload.built_arrays == {} and not datload.plane_written()
+
+
+### DAILY SERIES TESTING
+
+def test_daily_series():
+    series = datload.DailySeries(['access', 'login', 'search'])
+    dates, counts = series.get()
+    assert (np.diff(dates) > np.timedelta64(0, 'D')).all()
+    # only days the library web published
+    assert str(dates[0]) == '2015-11-01' and str(dates[-1]) == '2020-11-30'
+
+    # real month lengths
+    dates, counts = series.month(2020, 2)
+    assert len(dates) == 29 and counts[1, 18] == 30
+    assert len(series.month(2019, 4)[0]) == 30 and len(series.month(2015, 1)[0]) == 0
+    assert len(series.year(2019)[0]) == 365
+
+    dates, counts = series.range('2019-11-30', np.datetime64('2019-12-02'))
+    assert dates.astype(str).tolist() == ['2019-11-30', '2019-12-01', '2019-12-02']
+    assert (counts[:, 0] == datload.daily.year(2019)[:, 10, 29]).all()
+
+    dates, counts = series.last(90)
+    assert len(dates) == 90 and str(dates[-1]) == '2020-11-30'
+    # 2019-05-01 was wednesday
+    assert datload.weekdays(series.month(2019, 5)[0])[:3].tolist() == [2, 3, 4]
+
+
+
+def test_year_payload():
+    payload = datload.year_payload(2015)
+    # the library web published only november and december of 2015
+    assert payload['months'] == [11, 12, 13] and payload['labels'][-1] == 'Souhrnně celkem'
+    assert payload['places'] == ['V knihovně', 'Mimo knihovnu', 'Vše']
+
+    row = datload.summary[2015].loc['Listopad']
+    assert payload['summary'][0] == row.tolist()
+    assert payload['summary'][0][2] == row['Vyhledávání', 'Vše'] and payload['summary'][0][8] == row['Statistiky přihlášování', 'Vše']
+    assert len(payload['rating']) == 3 and len(payload['rating'][0]) == 2
+
+    dates, counts = datload.series.year(2015)
+    assert payload['dates'][0] == '2015-11-01' and len(payload['dates']) == len(payload['weekdays']) == len(dates)
+    assert payload['counts'] == counts.tolist() and payload['weekdays'][0] == 6 # sunday
+
+### ROLLUPS TESTING
+
+def test_calendar():
+    weekdays, valid = datroll.calendar(2020)
+    # 2020-01-01 was wednesday, february had 29 days
+    assert weekdays[0, 0] == 2 and weekdays[4, 12] == 2
+    assert valid[1, 28] and not valid[1, 29]
+    assert valid.sum() == 366
+
+
+def test_rollups():
+    tables = datroll.Rollups().get()
+    years = tables['years']
+    search, place_all = datroll.Rollups().topics.index('search'), datroll.places.index('Vše')
+
+    assert years == [2015, 2016, 2017, 2018, 2019, 2020]
+    assert tables['totals'][search, place_all, years.index(2019)] == 36850
+    assert tables['monthly'][search, place_all, years.index(2019), 4] == 2353
+    assert np.isnan(tables['monthly'][search, place_all, years.index(2015), 0])
+
+    # deltas and averages are NaN where they miss a month
+    monthly = tables['monthly'][search, place_all]
+    assert tables['year_delta'][search, place_all, years.index(2020), 0] == monthly[years.index(2020), 0] - monthly[years.index(2019), 0]
+    assert np.isnan(tables['year_delta'][search, place_all, 0]).all()
+    assert tables['month_delta'][search, place_all, years.index(2019), 0] == monthly[years.index(2019), 0] - monthly[years.index(2018), 11]
+    assert tables['rolling'][search, place_all, years.index(2019), 2] == monthly[years.index(2019), :3].mean()
+    assert np.isnan(tables['rolling'][search, place_all, years.index(2015), 11])
+
+    # a missing year is a gap, months are not compared across it
+    rollups = datroll.Rollups()
+    rollups.get()
+    gap = rollups.combine([2016, 2018, 2019])
+    monthly = gap['monthly'][search, place_all]
+    assert np.isnan(gap['month_delta'][search, place_all, 1, 0]) and np.isnan(gap['rolling'][search, place_all, 1, :2]).all()
+    assert gap['month_delta'][search, place_all, 1, 1] == monthly[1, 1] - monthly[1, 0]
+    assert gap['rolling'][search, place_all, 1, 2] == monthly[1, :3].mean()
+    assert gap['month_delta'][search, place_all, 2, 0] == monthly[2, 0] - monthly[1, 11]
+    assert np.isnan(gap['year_delta'][search, place_all, 1]).all() and gap['rolling'].shape == gap['monthly'].shape
+    assert rollups.combine([])['month_delta'].shape == (len(rollups.topics), len(datroll.places), 0, 12)
+
+    # weekday averages of 2019 add up to the year
+    weekdays, valid = datroll.calendar(2019)
+    days = np.bincount(weekdays[valid], minlength=7)
+    assert np.isclose((tables['weekdays'][search, years.index(2019)] * days).sum(), datload.daily.year(2019)[search].sum())
+
+
+### DATA VERSIONS TESTING
+
+def test_data_versions(tmp_path):
+    path = os.path.join(tmp_path, 'library.sqlite')
+    manifest = datpar.Manifest(os.path.join(tmp_path, 'manifest.json'))
+    df = pd.DataFrame({'Počet': [1, 2]}, index=pd.Index([1, 2], name='Den'))
+
+    datpar.save_days_to_store([df], ['access'], [2019], [5], manifest, path)
+    versions = datload.DataVersions(0, path)
+    assert versions.check() == [] and versions.version == 1
+
+    # access did not change
+    datpar.save_days_to_store([df, df + 1], ['access', 'login'], [2019], [5], manifest, path)
+    assert versions.check() == [('login', 2019, 5)]
+    assert versions.partitions == {('access', 2019, 5): 1, ('login', 2019, 5): 2}
+    assert versions.get('access', 2019, 5) == 1 and versions.get('summary', 2019) == 0
+    assert versions.get_days(2019, 5) == 2 and versions.version == 2
+    assert versions.check() == []
+
+
+### FIGURE CACHE TESTING
+
+def test_memoize(tmp_path):
+    app = dash.Dash(__name__)
+    cache = SharedCache(os.path.join(tmp_path, 'cache.sqlite'), size=2, touch=0)
+    calls = []
+    version = {'number': 1}
+
+    @memoize(app, lambda year: [year, version['number']], cache)
+    @app.callback(Output('graph', 'figure'), [Input('radio', 'value')])
+    def figure(year):
+        calls.append(year)
+        return {'data': [{'y': np.arange(3)}], 'year': year}
+
+    # dash calls the memoized callback, which returns the json response as stored
+    assert app.callback_map['graph.figure']['callback'] is figure
+    response = figure(2019)
+    assert json.loads(response)['response'] == {'graph': {'figure': {'data': [{'y': [0, 1, 2]}], 'year': 2019}}}
+    assert figure(2019) == response and calls == [2019]
+
+    # new data version
+    version['number'] = 2
+    figure(2019)
+    assert calls == [2019, 2019]
+
+    # the least recently used one is dropped
+    figure(2020), figure(2019), figure(2018), figure(2019), figure(2020)
+    assert calls == [2019, 2019, 2020, 2018, 2020]
+
+
+def test_shared_cache_touch(tmp_path):
+    cache = SharedCache(os.path.join(tmp_path, 'cache.sqlite'))
+    cache.set('a', '1')
+    used = cache.connect().execute('SELECT used FROM cache').fetchone()[0]
+
+    # hits within the touch interval do not write
+    assert cache.get('a') == '1' and cache.get('b') is None
+    assert cache.connect().execute('SELECT used FROM cache').fetchone()[0] == used
+
+    # the server starts with an empty one
+    cache.local.con.close()
+    cache.clear()
+    assert os.listdir(tmp_path) == [] and SharedCache(cache.path).get('a') is None
+
+
+def test_warm_tables(monkeypatch):
+    import fcntl
+    import app.visualization.interactivity as datint
+
+    datint.warming.join() # started at import
+    warmed = []
+    monkeypatch.setattr(datint, 'update_tables', lambda year, version: warmed.append(year))
+
+    # another worker is warming them
+    with open(f'{datint.shared_cache.path}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        datint.warm_tables()
+    assert warmed == []
+
+    datint.warm_tables()
+    assert warmed == list(datload.summary)
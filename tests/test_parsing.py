@@ -2,17 +2,47 @@ import pytest
 from pandas.testing import assert_frame_equal
 
 import os
+import sys
+import time
+import types
+import requests
+import threading
+import importlib.util
 import pandas as pd
+from prometheus_client import REGISTRY
 
 import app.parsing as datpar
+from app.visualization.data import load_months, read_store
+from tests.standin import start_standin
+
+
+def load_days(topic, year=None, month=None, path=datpar.store_path):
+    # {'year:month': dataframe} of stored days for all months or only for the given one, as they were parsed
+    where = 'WHERE topic = ?' + (' AND year = ? AND month = ?' if year else '')
+    params = (topic, year, month) if year else (topic,)
+    df = read_store(f'SELECT year, month, day, count FROM days {where} ORDER BY year, month, day', params, path)
+    datasets = read_store(f'SELECT year, month, day, dataset, count FROM day_datasets {where} ORDER BY year, month, position, day', params, path)
+
+    frames = {
+        f'{year}:{month}': pd.DataFrame({'Počet': group['count'].to_numpy()}, index=pd.Index(group['day'].to_numpy(), name='Den'))
+        for (year, month), group in df.groupby(['year', 'month'], sort=False)
+    }
+
+    # single datasets are stored only for months parsed since they are kept
+    for (year, month), group in datasets.groupby(['year', 'month'], sort=False):
+        frame = frames[f'{year}:{month}']
+        counts = group['count'].to_numpy().reshape(-1, len(frame.index))
+        for i, dataset in enumerate(group['dataset'].to_numpy()[::len(frame.index)]):
+            frame.insert(i + 1, dataset, counts[i], allow_duplicates=True)
+
+    return frames
 
 
 ### PARSED DATA TESTING
-### test values in csv files with values from the web
+### test values in the store with values from the web
 
 def test_data_months_summary():
-    path = os.path.join('data', 'months', 'summary_2019.csv')
-    summary_2019 = pd.read_csv(path, header=[0,1], index_col=0)
+    summary_2019 = load_months('summary', 2019)[2019]
 
     assert summary_2019.loc['Květen', 'Vyhledávání']['V knihovně'] == 121
     assert summary_2019.loc['Květen', 'Vyhledávání']['Mimo knihovnu'] == 2232
@@ -26,8 +56,7 @@ def test_data_months_summary():
     assert summary_2019.loc['Souhrnně celkem', 'Statistiky přihlášování']['Mimo knihovnu'] == 4437
     assert summary_2019.loc['Souhrnně celkem', 'Statistiky přihlášování']['Vše'] == 4463
 
-    path = os.path.join('data', 'months', 'summary_2015.csv')
-    summary_2015 = pd.read_csv(path, header=[0,1], index_col=0)
+    summary_2015 = load_months('summary', 2015)[2015]
 
     with pytest.raises(KeyError):
         summary_2015.loc['Únor']
@@ -36,8 +65,7 @@ def test_data_months_summary():
 
 
 def test_data_months_rating():
-    path = os.path.join('data', 'months', 'rating_2019.csv')
-    rating_2019 = pd.read_csv(path, header=[0,1], index_col=0)
+    rating_2019 = load_months('rating', 2019)[2019]
 
     assert rating_2019.loc['Červenec', 'Hodnocení - příspěvky']['V knihovně'] == 0
     assert rating_2019.loc['Červenec', 'Hodnocení - příspěvky']['Mimo knihovnu'] == 1
@@ -47,16 +75,14 @@ def test_data_months_rating():
     assert rating_2019.loc['Souhrnně celkem', 'Hodnocení - hvězdičky']['Mimo knihovnu'] == 0
     assert rating_2019.loc['Souhrnně celkem', 'Hodnocení - hvězdičky']['Vše'] == 0
 
-    path = os.path.join('data', 'months', 'rating_2020.csv')
-    rating_2020 = pd.read_csv(path, header=[0,1], index_col=0)
+    rating_2020 = load_months('rating', 2020)[2020]
 
     with pytest.raises(KeyError):
         rating_2020.loc['Prosinec']
 
 
 def test_data_days_access():
-    path = os.path.join('data', 'days', '2019', 'access_2019_5.csv')
-    access_2019_5 = pd.read_csv(path, index_col=0)
+    access_2019_5 = load_days('access', 2019, 5)['2019:5']
 
     assert len(access_2019_5.index) == 31
     assert access_2019_5.loc[1, 'Počet'] == 21
@@ -68,8 +94,7 @@ def test_data_days_access():
 
 
 def test_data_days_login():
-    path = os.path.join('data', 'days', '2020', 'login_2020_2.csv')
-    login_2020_2 = pd.read_csv(path, index_col=0)
+    login_2020_2 = load_days('login', 2020, 2)['2020:2']
 
     assert len(login_2020_2.index) == 29
     assert login_2020_2.loc[8, 'Počet'] == 4
@@ -81,8 +106,7 @@ def test_data_days_login():
 
 
 def test_data_days_search():
-    path = os.path.join('data', 'days', '2016', 'search_2016_7.csv')
-    search_2016_7 = pd.read_csv(path, index_col=0)
+    search_2016_7 = load_days('search', 2016, 7)['2016:7']
 
     assert len(search_2016_7.index) == 31
     assert search_2016_7.loc[12, 'Počet'] == 97 + 31 + 5
@@ -93,20 +117,345 @@ def test_data_days_search():
         search_2016_7.loc[32]
 
 
-### PARSING DATA TESTING
+def assert_loaded_equal(parsed, loaded):
+    # the store loads counts as compact unsigned ints and month names as categories
+    assert_frame_equal(parsed, loaded, check_dtype=False, check_index_type=False, check_categorical=False)
+
+
+### OFFLINE PARSING TESTING
+### parse recorded pages served by a local stand-in server
 
-def test_parsing_months():
-    url = 'https://susice.tritius.cz/statistics'
+@pytest.fixture(scope='module')
+def standin_url():
+    server, url = start_standin()
+    yield url
+    server.shutdown()
 
-    years = [i for i in range(2015, 2021)]
+
+def test_parsing_months(standin_url):
+    years = [2015, 2019, 2020]
     topics = ['rating']
-    dataframes_months = datpar.get_dataframes_months(url, topics, years)
+    dataframes_months = datpar.get_dataframes_months(standin_url, topics, years)
+
+    assert len(dataframes_months) == 3
+    assert dataframes_months[1].loc['Červenec', 'Hodnocení - příspěvky']['Vše'] == 1
+
+    topics = ['rating', 'summary']
+    dataframes_months = datpar.get_dataframes_months(standin_url, topics, years)
 
     assert len(dataframes_months) == 6
+    assert_loaded_equal(dataframes_months[4], load_months('summary', 2019)[2019])
+
+
+def test_fetching_order(standin_url):
+    links = [f'{standin_url}/access/2019/{month}' for month in range(12, 0, -1)]
+    pages = datpar.fetch_pages(links, workers=4)
+
+    assert pages == [requests.get(link).content for link in links]
+
+    with pytest.raises(requests.HTTPError):
+        datpar.fetch_pages([f'{standin_url}/access/2019/13'])
+
+
+def test_parsing_days_offline(standin_url):
+    topics = ['access', 'login', 'search']
+    dataframes_days = datpar.get_dataframes_days(standin_url, topics, [2019], [5, 6])
+
+    assert len(dataframes_days) == 6
+    for df, (topic, month) in zip(dataframes_days, [(topic, month) for topic in topics for month in [5, 6]]):
+        assert_loaded_equal(df[['Počet']], load_days(topic, 2019, month)[f'2019:{month}'][['Počet']])
+
+
+def test_store(standin_url, tmp_path):
+    path = os.path.join(tmp_path, 'library.sqlite')
+
+    dataframes_months = datpar.get_dataframes_months(standin_url, ['summary'], [2015, 2019])
+    written = datpar.save_months_to_store(dataframes_months, ['summary'], [2015, 2019], path=path)
+    assert written == [('summary', 2015, None), ('summary', 2019, None)]
+    assert_loaded_equal(dataframes_months[0], load_months('summary', path=path)[2015])
+
+    dataframes_days = datpar.get_dataframes_days(standin_url, ['login'], [2020], [2])
+    datpar.save_days_to_store(dataframes_days, ['login'], [2020], [2], path=path)
+    assert_loaded_equal(dataframes_days[0], load_days('login', path=path)['2020:2'])
+
+
+def test_manifest(standin_url, tmp_path):
+    manifest = datpar.Manifest(os.path.join(tmp_path, 'manifest.json'))
+    links = [f'{standin_url}/login/2019/{month}' for month in [1, 2]]
+
+    assert None not in datpar.fetch_pages(links, manifest=manifest)
+    manifest.commit()
+    # recorded pages did not change
+    assert datpar.fetch_pages(links, manifest=manifest) == [None, None]
+
+    df = pd.DataFrame({'Počet': [4]}, index=pd.Index([1], name='Den'))
+    assert manifest.is_changed_data('login/2019/1', df)
+    assert not manifest.is_changed_data('login/2019/1', df)
+    assert manifest.is_changed_data('login/2019/1', df + 1)
+
+    manifest.commit()
+    assert datpar.Manifest(manifest.path).partitions == manifest.partitions
+
+
+def test_parsing_chart_data():
+    path = os.path.join('tests', 'pages', 'statistics', 'search', '2016', '7.html')
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    data = datpar.parse_chart_data(content)
+    assert [dataset['data'][11] for dataset in data['datasets']] == [97, 31, 5]
+
+    df = datpar.make_dataframe_days(data)
+    assert list(df.columns) == ['Počet', 'Online katalog', 'Mobilní aplikace', 'Ostatní']
+    assert list(df.loc[12]) == [97 + 31 + 5, 97, 31, 5]
+    assert len(df.index) == 31 and df.index[0] == 1
+
+    # position of the script in the page does not matter
+    moved = content.replace(b'<script>', b'<script>var x = 1;</script>\n<script>', 1)
+    assert datpar.parse_chart_data(moved) == data
+
+    with pytest.raises(ValueError):
+        datpar.parse_chart_data(b'<html><script></script></html>')
+
+
+def test_parse_pool(standin_url):
+    # month pages are parsed in one pool reused by all calls, day pages in this process
+    links = [f'{standin_url}/{topic}/{year}' for topic in ['rating', 'summary'] for year in [2015, 2019, 2020]] * 3
+    assert len(links) >= datpar.parse_processes_min_pages
+
+    dataframes = datpar.get_dataframes(links, datpar.parse_page_months, processes=True)
+    pool = datpar.parse_pool
+    assert pool is not None and datpar.get_dataframes(links, datpar.parse_page_months, processes=True)[0].equals(dataframes[0])
+    assert datpar.parse_pool is pool
+    for df, df_inline in zip(dataframes, datpar.get_dataframes(links, datpar.parse_page_months)):
+        assert_frame_equal(df, df_inline)
+
+
+def test_archive(standin_url, tmp_path):
+    archive = datpar.PageArchive(os.path.join(tmp_path, 'archive.sqlite'))
+    topics = ['access', 'login', 'search']
+    months = list(range(1, 13))
+
+    dataframes_days = datpar.get_dataframes_days(standin_url, topics, [2019], months, archive=archive)
+
+    # parsed again only from the archive
+    replayed = datpar.get_dataframes_days(standin_url, topics, [2019], months, archive=archive, replay=True)
+    for df, df_replayed in zip(dataframes_days, replayed):
+        assert_frame_equal(df, df_replayed)
+
+    assert datpar.get_dataframes_months(standin_url, ['summary'], [2019], archive=archive, replay=True) == [None]
+
+    # unchanged pages are stored only once, the archive can be viewed as it was before a change
+    link = f'{standin_url}/login/2019/1'
+    content = archive.get(link)
+    archive.put(link, content)
+    assert len(archive.history(link)) == 1
+
+    archive.put(link, content + b' ')
+    fetched = archive.history(link)
+    assert len(fetched) == 2
+    assert archive.get(link) == content + b' '
+    assert datpar.PageArchive(archive.path, at=fetched[0]).get(link) == content
+
+
+def test_standin_archive(standin_url, tmp_path):
+    archive = datpar.PageArchive(os.path.join(tmp_path, 'archive.sqlite'))
+    links = [f'{standin_url}/summary/2019', f'{standin_url}/search/2016/7']
+    pages = datpar.fetch_pages(links)
+    for link, content in zip(links, pages):
+        archive.put(link, content)
+
+    # the stand-in replays the archive as if it was the archived server
+    server, url = start_standin(archive=archive, origin=standin_url[:-len('/statistics')])
+    assert datpar.fetch_pages([f'{url}/summary/2019', f'{url}/search/2016/7']) == pages
+    with pytest.raises(requests.HTTPError):
+        datpar.fetch_pages([f'{url}/summary/2018'])
+    server.shutdown()
+
+
+def test_discover(standin_url, tmp_path):
+    # the stand-in has summary pages only for 2015, 2019 and 2020
+    topics, published, summaries = datpar.discover(standin_url, range(2015, 2022))
+
+    assert topics == ['access', 'login', 'search', 'rating', 'summary']
+    assert published == {2015: [11, 12], 2019: list(range(1, 13)), 2020: list(range(1, 12))}
+    assert list(summaries) == list(published) and summaries[2019].loc['Květen', 'Vyhledávání']['Vše'] == 2353
+
+    path = os.path.join(tmp_path, 'library.sqlite')
+    dataframes_days = datpar.get_dataframes_days(standin_url, ['login'], [2020], [2])
+    # as the not yet published december used to be stored
+    datpar.save_days_to_store(dataframes_days + [dataframes_days[0] * 0], ['login'], [2020], [2, 12], path=path)
+
+    assert datpar.delete_unpublished_days(published, path) == [('login', 2020, 12)]
+    assert list(load_days('login', path=path)) == ['2020:2']
+
+
+def test_update_data(standin_url, tmp_path, monkeypatch):
+    # the manifest, archive and store are created in data/ of the working directory
+    monkeypatch.chdir(tmp_path)
+    links = []
+    fetch_page = datpar.fetch_page
+    monkeypatch.setattr(datpar, 'fetch_page', lambda session, link, *args: links.append(link) or fetch_page(session, link, *args))
+
+    written = datpar.update_data(standin_url, ['access'], ['rating', 'summary'], 2019, 5)
+    assert sorted(written) == [('access', 2019, 5), ('rating', 2019, None), ('summary', 2019, None)]
+    # the summary page is downloaded only once, by discover
+    assert sorted(links) == [f'{standin_url}/{page}' for page in ['access/2019/5', 'rating/2019', 'summary/2019']]
+    assert load_months('summary', 2019)[2019].loc['Květen', 'Vyhledávání']['Vše'] == 2353
+
+
+### RETRY AND RATE LIMIT TESTING
+### a stub session answers with the given statuses or connection errors, sleeps are recorded instead of waited
+
+class StubSession:
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def get(self, link, headers=None, timeout=None):
+        self.calls += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        page = requests.Response()
+        page.status_code, page.url, page._content = answer, link, b'page'
+        return page
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(datpar.time, 'sleep', lambda seconds: sleeps.append(seconds) if seconds else None)
+    return sleeps
+
+
+def test_fetch_retries(sleeps):
+    link = 'http://library/statistics/access/2019/5'
+    retried = REGISTRY.get_sample_value('scraper_retries_total', {'page': 'access'}) or 0
+
+    # too many requests, server and connection errors are tried again with a doubling backoff
+    session = StubSession([429, 503, requests.ConnectionError(), 200])
+    assert datpar.fetch_page(session, link, datpar.RateLimiter(0)).content == b'page'
+    assert session.calls == 4 and sleeps == [datpar.backoff, datpar.backoff * 2, datpar.backoff * 4]
+    assert REGISTRY.get_sample_value('scraper_retries_total', {'page': 'access'}) == retried + 3
+
+
+def test_fetch_retries_exhausted(sleeps):
+    link = 'http://library/statistics/access/2019/5'
+
+    session = StubSession([500] * (datpar.retries + 1))
+    with pytest.raises(requests.HTTPError):
+        datpar.fetch_page(session, link, datpar.RateLimiter(0))
+    assert session.calls == datpar.retries + 1 and len(sleeps) == datpar.retries
+
+    session = StubSession([requests.Timeout()] * (datpar.retries + 1))
+    with pytest.raises(requests.Timeout):
+        datpar.fetch_page(session, link, datpar.RateLimiter(0))
+    assert session.calls == datpar.retries + 1
+
+    # client errors do not get better by waiting
+    sleeps.clear()
+    session = StubSession([404])
+    with pytest.raises(requests.HTTPError):
+        datpar.fetch_page(session, link, datpar.RateLimiter(0))
+    assert session.calls == 1 and sleeps == []
+
+
+def test_rate_limiter():
+    # requests of all threads start at least 1 / rate apart
+    limiter = datpar.RateLimiter(20)
+    starts = []
+    def start():
+        limiter.wait()
+        starts.append(time.monotonic())
+
+    threads = [threading.Thread(target=start) for _ in range(6)]
+    first = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # the n-th request starts no sooner than n intervals after the first one could
+    assert all(started - first >= n * 0.05 - 0.001 for n, started in enumerate(sorted(starts)))
+    assert sorted(starts)[-1] - first < 2
+
+
+### REFRESH WORKER TESTING
+
+def load_gunicorn_conf(tmp_path, monkeypatch):
+    # as gunicorn reads it, the metrics of the tests stay in this process
+    monkeypatch.setenv('prometheus_multiproc_dir', str(tmp_path))
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', 'gunicorn.conf.py')
+    conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(conf)
+    return conf
+
+
+def wait_for(condition, seconds=10):
+    end = time.monotonic() + seconds
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_refresh_worker_restarted(tmp_path, monkeypatch):
+    conf = load_gunicorn_conf(tmp_path, monkeypatch)
+    conf.refresh_command = [sys.executable, '-c', 'raise SystemExit(3)']
+    conf.refresh_restart_delay = 0.01
+    errors = []
+    server = types.SimpleNamespace(log=types.SimpleNamespace(info=lambda *args: None, error=lambda *args: errors.append(args)))
+
+    supervisor = threading.Thread(target=conf.supervise_refresher, args=(server,))
+    supervisor.start()
+    # a dying one is logged and started again
+    assert wait_for(lambda: len(errors) >= 2) and errors[0][1] == 3
+
+    conf.refresh_command = [sys.executable, '-c', 'import time; time.sleep(60)']
+    assert wait_for(lambda: conf.refresher.args == conf.refresh_command and conf.refresher.poll() is None)
+    refresher = conf.refresher
+
+    # and stopped with the server
+    conf.on_exit(server)
+    supervisor.join(10)
+    assert not supervisor.is_alive() and refresher.poll() is not None and conf.refresher is refresher
+
 
-    years = [i for i in range(2018, 2020)]
-    topics = ['rating', 'access']
-    dataframes_months = datpar.get_dataframes_months(url, topics, years)
+def test_refresh_errors_logged(monkeypatch, caplog):
+    import app.refresh as datref
+
+    def fail(*args):
+        raise OSError('disk full')
+    class Stop(Exception):
+        pass
+    def stop(seconds):
+        raise Stop
+
+    # a failing plane write does not end the refresh loop
+    failed = REGISTRY.get_sample_value('refresh_runs_total', {'result': 'failed'}) or 0
+    monkeypatch.setattr(datref, 'ensure_plane', fail)
+    monkeypatch.setattr(datref.time, 'sleep', stop)
+    with pytest.raises(Stop):
+        datref.run()
+    assert 'refresh failed' in caplog.text and 'disk full' in caplog.text
+    assert REGISTRY.get_sample_value('refresh_runs_total', {'result': 'failed'}) == failed + 1
+
+
+### METRICS TESTING
+
+def test_scraper_metrics(standin_url):
+    def value(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    before = [value('scraper_responses_total', page='access', status='200'), value('scraper_responses_total', page='access', status='404'),
+              value('scraper_fetch_seconds_count', page='access'), value('scraper_parse_seconds_count', page='access')]
+
+    datpar.get_dataframes_days(standin_url, ['access'], [2019], [5, 6])
+    with pytest.raises(requests.HTTPError):
+        datpar.fetch_pages([f'{standin_url}/access/2019/13'])
+
+    assert value('scraper_responses_total', page='access', status='200') - before[0] >= 2
+    assert value('scraper_responses_total', page='access', status='404') - before[1] >= 1
+    assert value('scraper_fetch_seconds_count', page='access') - before[2] >= 3
+    assert value('scraper_parse_seconds_count', page='access') - before[3] >= 2
 
-    assert len(dataframes_months) == 4
-    
\ No newline at end of file